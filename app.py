@@ -1,21 +1,23 @@
 import os
 import secrets
+import hashlib
 from datetime import datetime
 from functools import wraps
 
 from flask import (
     Flask, render_template, request, redirect,
-    url_for, send_from_directory, Response, abort
+    url_for, send_file, Response, abort, jsonify
 )
+from sqlalchemy import func
+from werkzeug.security import safe_join
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
-from sqlalchemy import text
 
-from models import SessionLocal, init_db, Website, Scan, PageScan
-from crawler import SiteCrawler
-from generator import generate_all
-from emailer import send_report
-from urllib.parse import urlparse
+from models import db_session, init_db, Website, Scan, PageScan, ScanJob, SiteSummary
+from cache import TTLCache
+from metrics import Histogram, Exposition
+from generator import index_filename, write_index
+from scanner import run_scan, sitemap_loc_base
+from jobs import ScanQueue, schedule_all, schedule_site
 
 # ─── Basic Auth ────────────────────────────────────────────────────
 AUTH_USER = os.getenv("AUTH_USER", "admin")
@@ -41,179 +43,127 @@ def requires_auth(f):
 
 # ─── App & DB setup ───────────────────────────────────────────────
 init_db()
-session = SessionLocal()
+# thread-local: every request, scheduler and scan thread gets its own
+session = db_session
 app = Flask(__name__)
 
-# ─── Scheduler setup ─────────────────────────────────────────────
+@app.teardown_appcontext
+def remove_session(exc=None):
+    db_session.remove()
+
+# ─── Scheduler & scan queue ──────────────────────────────────────
 sched = BackgroundScheduler(timezone="Europe/Paris")
+scan_queue = ScanQueue(run_scan)
 
-def decide_lastmod(p, prev_map, crawl_dt):
-    """
-    p: dict from crawler with loc, status, lastmod, redirect_to, hash
-    prev_map: { url -> PageScan } from the previous scan
-    crawl_dt: datetime.utcnow() of this run
-    """
-    # if the server gave us a Last-Modified header, use it
-    if p.get("lastmod"):
-        return p["lastmod"], p.get("hash")
-
-    # fallback: use URL of the final loc for redirects, or loc for 200
-    final_url = p["loc"] if p["status"] == 200 else p["redirect_to"]
-    prev = prev_map.get(final_url)
-
-    # first time ever: record this crawl date and its hash
-    if not prev:
-        return crawl_dt, p.get("hash")
-
-    # content changed?
-    if p.get("hash") and p["hash"] != prev.content_hash:
-        return crawl_dt, p["hash"]
-
-    # unchanged: keep old lastmod and old hash
-    return prev.lastmod, prev.content_hash
-
-
-def run_scan(website_id):
-    ws = session.get(Website, website_id)
-    try:
-        data   = SiteCrawler(ws.url).crawl()
-        crawl_dt = datetime.utcnow()
-        pages  = data["pages"]    # list of dicts with loc/status/lastmod/redirect_to
-        images = data["images"]
-        videos = data["videos"]
-
-        
-
-        outdir = os.path.join("data", f"site_{ws.id}")
-        name   = urlparse(ws.url).netloc
-        
-        ws.last_scan   = datetime.utcnow()
-        ws.last_status = "ok"
-        # summary record
-        scan = Scan(
-            website_id     = ws.id,
-            timestamp      = datetime.utcnow(),
-            pages_found    = len(pages),
-            images_found   = len(images),
-            videos_found   = len(videos),
-            pages_included = 0,
-            images_included= 0,
-            videos_included= 0,
-            errors         = None,
-            extra_info     = {} 
-        )
-        session.add(scan)
-        session.flush()
+# ─── Read view cache ──────────────────────────────────────────────
+# rendered dashboard and broken-link pages; dropped when a scan ends in
+# this process, and expiring after VIEW_CACHE_TTL seconds otherwise
+VIEW_CACHE_TTL = int(os.getenv("VIEW_CACHE_TTL", 30))
+view_cache = TTLCache(VIEW_CACHE_TTL)
 
-        last = (
-        session.query(Scan)
-               .filter_by(website_id=ws.id)
-               .order_by(Scan.timestamp.desc())
-               .offset(1)    # skip the one we just inserted
-               .limit(1)
-               .one_or_none()
-        )
-        prev_map = {}
-        if last:
-            prev_entries = (
-                session.query(PageScan)
-                    .filter_by(scan_id=last.id)
-                    .all()
-            )
-            prev_map = { p.url: p for p in prev_entries }
-
-        included_count = 0
-            
-            # detailed per-page rows
-        page_urls = []    
-        for p in pages:
-            # decide if we include it in sitemap (200 or 301 w/ redirect_to)
-            final_url = p["loc"] if p["status"] == 200 else p.get("redirect_to")
-            if not final_url or p["status"] not in (200, 301):
-                # still record in DB, but don’t count towards pages_included
-                lm, ch = decide_lastmod(p, prev_map, crawl_dt)
-                session.add(PageScan(
-                scan_id     = scan.id,
-                url         = p["loc"],
-                status      = p["status"],
-                lastmod     = lm,
-                redirect_to = p.get("redirect_to"),
-                content_hash= ch
-                ))
-                continue
-
-            # this URL goes into sitemap
-            lm, ch = decide_lastmod(p, prev_map, crawl_dt)
-            toAdd = PageScan(
-                scan_id     = scan.id,
-                url         = final_url,
-                status      = p["status"],
-                lastmod     = lm,
-                redirect_to = p.get("redirect_to"),
-                content_hash= ch
-            )
-            session.add(toAdd)
-            page_urls.append(toAdd)
-            
-        
-        pf, imf, vf = generate_all(
-            ws.id, name, outdir, page_urls, images, videos
-        )
-        scan.pages_included = len(page_urls)
-        scan.images_included = len(imf)
-        scan.videos_included = len(vf)
-        scan.extra_info = {"images": imf, "videos": vf}
-        session.commit()
+def invalidate_views(site_id, job_id=None):
+    view_cache.invalidate(lambda k: k[0] == "index" or k[:2] == ("broken", site_id))
 
-        
-        
-        body = (
-            f"Scan ok for {ws.url}\n"
-            f"Pages found: {len(pages)}\n"
-            f"Pages indexed: {len(page_urls)}\n"
-            f"Images: {len(images)}\n"
-            f"Videos: {len(videos)}\n"
-            f"Sitemaps directory: {outdir}"
-        )
-        send_report(f"[SitemapGen] Success {ws.url}", body)
+scan_queue.on_done.append(invalidate_views)
 
-    except Exception as e:
-        session.rollback()
-        ws.last_scan   = datetime.utcnow()
-        ws.last_status = "error"
-        session.commit()
+BROKEN_PAGE_SIZE = 100
 
-        err_scan = Scan(
-            website_id     = ws.id,
-            pages_found    = 0,
-            images_found   = 0,
-            videos_found   = 0,
-            pages_included = 0,
-            images_included= 0,
-            videos_included= 0,
-            errors         = str(e),
-            extra_info     = {}
-        )
-        session.add(err_scan)
-        session.commit()
+# ─── Sitemap index cache ──────────────────────────────────────────
+# (site_id, stype) -> {"file": name} for a single sitemap, or
+# {"body", "etag", "last_modified"} for a persisted sitemap index, plus
+# the "scan_id" of the scan it was built from. Rebuilt lazily, when a
+# newer successful scan exists (scans may finish in scheduler.py) or
+# right away by invalidate_sitemap_cache for scans of this process.
+sitemap_cache = {}
+
+def invalidate_sitemap_cache(site_id, job_id=None):
+    for key in [k for k in sitemap_cache if k[0] == site_id]:
+        sitemap_cache.pop(key, None)
+
+scan_queue.on_done.append(invalidate_sitemap_cache)
+
+def sitemap_entry(site_id, stype):
+    key = (site_id, stype)
+    latest = (
+        session.query(Scan.id)
+               .filter_by(website_id=site_id, errors=None)
+               .order_by(Scan.timestamp.desc())
+               .limit(1)
+               .scalar()
+    )
+    entry = sitemap_cache.get(key)
+    if entry is not None and entry["scan_id"] == latest:
+        return entry
 
-        send_report(f"[SitemapGen] ERROR {ws.url}", f"Error: {e}")
+    basedir = os.path.join("data", f"site_{site_id}")
+    last = session.get(Scan, latest) if latest is not None else None
+    files = (last.extra_info or {}).get(stype) if last else None
+    if files is None and os.path.isdir(basedir):
+        # scans from before the file lists were recorded
+        files = sorted(
+            f for f in os.listdir(basedir)
+            if f.startswith(f"{stype}_site{site_id}_") and f.endswith(".xml")
+        )
+        if len(files) > 1:
+            write_index(site_id, basedir, stype, files, sitemap_loc_base(site_id))
 
-def schedule_all():
-    sched.remove_all_jobs()
-    result = session.execute(text("SELECT * FROM websites"))
-    for ws in result:
-        trig = CronTrigger.from_crontab(ws.cron_schedule)
-        sched.add_job(run_scan, trig, args=[ws.id], id=f"site_{ws.id}")
+    if not files:
+        entry = {"scan_id": latest}
+    elif len(files) == 1:
+        entry = {"scan_id": latest, "file": files[0]}
+    else:
+        path = os.path.join(basedir, index_filename(site_id, stype))
+        with open(path, "rb") as f:
+            body = f.read()
+        entry = {
+            "scan_id": latest,
+            "body": body,
+            "etag": hashlib.sha1(body).hexdigest(),
+            "last_modified": datetime.utcfromtimestamp(os.path.getmtime(path))
+        }
+    sitemap_cache[key] = entry
+    return entry
+
+def send_sitemap(directory, filename):
+    """
+    Serve a generated sitemap, preferring its precompressed .gz twin when
+    the client accepts gzip. Conditional requests get a 304.
+    """
+    path = safe_join(directory, filename)
+    if path is None:
+        abort(404)
+    # sitemaps are written relative to the working directory; send_file
+    # would resolve a relative path against app.root_path instead
+    path = os.path.abspath(path)
+    if not os.path.isfile(path):
+        abort(404)
+    gz_path = path + ".gz"
+    if (filename.endswith(".xml") and request.accept_encodings["gzip"]
+            and os.path.isfile(gz_path)):
+        resp = send_file(gz_path, mimetype="application/xml", conditional=True)
+        resp.headers["Content-Encoding"] = "gzip"
+    else:
+        resp = send_file(path, conditional=True)
+    resp.headers["Vary"] = "Accept-Encoding"
+    return resp
 
 # ─── Routes ───────────────────────────────────────────────────────–
 
 @app.route("/", methods=["GET"])
 @requires_auth
 def index():
-    sites = session.query(Website).all()
-    # attach last scan summary to each for the UI
-    return render_template("index.html", sites=sites)
+    html = view_cache.get(("index",))
+    if html is None:
+        # one query: each site with its materialized summary (if scanned)
+        sites = (
+            session.query(Website, SiteSummary)
+                   .outerjoin(SiteSummary, SiteSummary.website_id == Website.id)
+                   .order_by(Website.id)
+                   .all()
+        )
+        html = render_template("index.html", sites=sites)
+        view_cache.set(("index",), html)
+    return html
 
 @app.route("/add", methods=["POST"])
 @requires_auth
@@ -231,39 +181,74 @@ def add():
     session.commit()
 
     # schedule immediately
-    trig = CronTrigger.from_crontab(schedule)
-    sched.add_job(run_scan, trig, args=[ws.id], id=f"site_{ws.id}")
+    schedule_site(sched, scan_queue, ws.id, schedule)
+    view_cache.invalidate(lambda k: k[0] == "index")
 
     return redirect(url_for("index"))
 
 @app.route("/scan_now/<int:site_id>", methods=["POST"])
 @requires_auth
 def scan_now(site_id):
-    run_scan(site_id)
+    if not session.get(Website, site_id):
+        abort(404)
+    job, created = scan_queue.enqueue(site_id)
+    if request.headers.get("X-Requested-With") == "XMLHttpRequest":
+        # 202: queued now; 409: a scan of this site is already queued/running
+        return jsonify(job.to_dict()), 202 if created else 409
     return redirect(url_for("index"))
 
+@app.route("/jobs/<int:job_id>")
+@requires_auth
+def job_status(job_id):
+    job = scan_queue.get(job_id)
+    if not job:
+        abort(404)
+    return jsonify(job.to_dict())
+
 @app.route("/reports/<path:filename>")
 @requires_auth
 def reports(filename):
-    return send_from_directory("data", filename)
+    return send_sitemap("data", filename)
 
 @app.route("/broken/<int:site_id>")
 @requires_auth
 def broken(site_id):
-    last = (
-        session.query(Scan)
-               .filter_by(website_id=site_id)
-               .order_by(Scan.timestamp.desc())
-               .first()
-    )
-    broken_pages = []
-    if last:
-        broken_pages = (
-            session.query(PageScan)
-                   .filter_by(scan_id=last.id, status=404)
+    # keyset pagination: the page after PageScan.id `after`
+    after = request.args.get("after", 0, type=int)
+    key   = ("broken", site_id, after)
+    html  = view_cache.get(key)
+    if html is not None:
+        return html
+
+    summary = session.get(SiteSummary, site_id)
+    if summary and summary.scan_id:
+        scan_id, checked, total = summary.scan_id, summary.scan_timestamp, summary.broken_count
+    else:
+        # sites not scanned since summaries were introduced
+        last = (
+            session.query(Scan.id, Scan.timestamp)
+                   .filter_by(website_id=site_id, errors=None)
+                   .order_by(Scan.timestamp.desc())
+                   .first()
+        )
+        scan_id, checked, total = (last.id, last.timestamp, None) if last else (None, None, 0)
+
+    rows = []
+    if scan_id is not None:
+        rows = (
+            session.query(PageScan.id, PageScan.url)
+                   .filter(PageScan.scan_id == scan_id, PageScan.status == 404,
+                           PageScan.id > after)
+                   .order_by(PageScan.id)
+                   .limit(BROKEN_PAGE_SIZE + 1)
                    .all()
         )
-    return render_template("broken.html", broken=broken_pages, site_id=site_id)
+    next_after = rows[BROKEN_PAGE_SIZE - 1].id if len(rows) > BROKEN_PAGE_SIZE else None
+    html = render_template("broken.html", broken=rows[:BROKEN_PAGE_SIZE],
+                           site_id=site_id, checked=checked, total=total,
+                           after=after, next_after=next_after)
+    view_cache.set(key, html)
+    return html
 
 @app.route("/api/sitemap/<int:site_id>/<string:stype>")
 def api_sitemap(site_id, stype):
@@ -272,30 +257,72 @@ def api_sitemap(site_id, stype):
     if not ws or token != ws.api_token:
         abort(403)
 
-    basedir = os.path.join("data", f"site_{site_id}")
-    files   = sorted(
-        f for f in os.listdir(basedir)
-        if f.startswith(f"{stype}_site{site_id}_")
-    )
-    if not files:
+    if stype not in ("pages", "images", "videos"):
+        abort(404)
+    entry = sitemap_entry(site_id, stype)
+    if "file" not in entry and "body" not in entry:
         abort(404)
-
-    # sitemap index
-    if len(files) > 1:
-        today = datetime.utcnow()
-        xml   = '<?xml version="1.0"?>\n'
-        xml  += '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
-        for fn in files:
-            loc = f"{os.getenv('BASE_URL')}/reports/{fn}"
-            xml+= (f"  <sitemap>\n"
-                   f"    <loc>{loc}</loc>\n"
-                   f"    <lastmod>{today}</lastmod>\n"
-                   f"  </sitemap>\n")
-        xml += "</sitemapindex>"
-        return Response(xml, mimetype="application/xml")
 
     # single file
-    return send_from_directory(basedir, files[0], mimetype="application/xml")
+    if "file" in entry:
+        return send_sitemap(os.path.join("data", f"site_{site_id}"), entry["file"])
+
+    # sitemap index, persisted by generate_all
+    resp = Response(entry["body"], mimetype="application/xml")
+    resp.set_etag(entry["etag"])
+    resp.last_modified = entry["last_modified"]
+    return resp.make_conditional(request)
+
+@app.route("/metrics")
+@requires_auth
+def metrics():
+    """
+    Prometheus text exposition: the metrics of each site's latest
+    successful scan (as stored in Scan.extra_info) and the scan queue.
+    """
+    out = Exposition()
+    for status, n in session.query(ScanJob.status, func.count()).group_by(ScanJob.status):
+        out.gauge("sitemapz_scan_jobs", n, "Scan jobs by status", status=status)
+
+    for ws in session.query(Website.id):
+        last = (
+            session.query(Scan.timestamp, Scan.pages_found, Scan.extra_info)
+                   .filter_by(website_id=ws.id, errors=None)
+                   .order_by(Scan.timestamp.desc())
+                   .first()
+        )
+        if not last:
+            continue
+        site = ws.id
+        out.gauge("sitemapz_last_scan_timestamp_seconds",
+                  (last.timestamp - datetime(1970, 1, 1)).total_seconds(),
+                  "End of the latest successful scan", site=site)
+        out.gauge("sitemapz_last_scan_pages", last.pages_found,
+                  "Pages found by the latest scan", site=site)
+        m = (last.extra_info or {}).get("metrics")
+        if not m:
+            continue
+        for name, value in m.get("gauges", {}).items():
+            out.gauge(f"sitemapz_last_scan_{name}", value, site=site)
+        for phase, seconds in m.get("phases", {}).items():
+            out.gauge("sitemapz_last_scan_phase_seconds", seconds,
+                      "Wall-clock time per scan phase", site=site, phase=phase)
+        for status, n in m.get("counters", {}).get("status", {}).items():
+            out.gauge("sitemapz_last_scan_responses", n,
+                      "HTTP responses by status code", site=site, code=status)
+        for error, n in m.get("counters", {}).get("errors", {}).items():
+            out.gauge("sitemapz_last_scan_fetch_errors", n,
+                      "Failed fetches by exception type", site=site, error=error)
+        for reason, n in m.get("counters", {}).get("retries", {}).items():
+            out.gauge("sitemapz_last_scan_fetch_retries", n,
+                      "Fetches retried, by reason", site=site, reason=reason)
+        for reason, n in m.get("counters", {}).get("failures", {}).items():
+            out.gauge("sitemapz_last_scan_fetch_failures", n,
+                      "URLs given up on, by reason", site=site, reason=reason)
+        for name, h in m.get("histograms", {}).items():
+            out.histogram(f"sitemapz_last_scan_{name}", Histogram.from_dict(h),
+                          site=site)
+    return Response(out.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/download_script/<int:site_id>")
 @requires_auth
@@ -321,6 +348,7 @@ function fetch_sitemap($type) {{
     $url = "$baseUrl/api/sitemap/$siteId/$type?token=$token";
     $ch  = curl_init($url);
     curl_setopt($ch, CURLOPT_RETURNTRANSFER, true);
+    curl_setopt($ch, CURLOPT_ENCODING, ''); // accept gzip, decoded by curl
     $data = curl_exec($ch);
     if(curl_getinfo($ch, CURLINFO_HTTP_CODE) !== 200) {{
         http_response_code(500);
@@ -340,6 +368,7 @@ fetch_sitemap('pages');
     )
 
 if __name__ == "__main__":
-    schedule_all()
+    scan_queue.start()
+    schedule_all(sched, scan_queue)
     sched.start()
     app.run(host="0.0.0.0", port=8000)
@@ -0,0 +1,123 @@
+"""
+Link extractor benchmark: pages/sec and peak memory per extractor.
+
+Runs every registered extractor over a corpus of saved HTML files, each
+in its own subprocess so peak RSS is not shared between them. Reports
+the process' peak RSS (corpus loaded included) and, from tracemalloc,
+the most memory one extract() call allocated at once. Point
+--corpus at a directory of saved pages; if it holds no .html files, a
+synthetic content-heavy corpus is generated there first.
+
+    python benchmarks/bench_extractors.py --corpus /tmp/html-corpus
+"""
+import os
+import sys
+import glob
+import json
+import time
+import random
+import resource
+import tempfile
+import tracemalloc
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from extractors import EXTRACTORS, get_extractor
+
+
+def generate_corpus(path, pages, seed=1):
+    rnd = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    words = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do".split()
+    for i in range(pages):
+        parts = ["<!doctype html><html><head><title>Page %d</title>" % i,
+                 '<meta charset="utf-8"><link rel="stylesheet" href="/s.css">',
+                 "</head><body><nav>"]
+        parts += [f'<a href="/section/{k}">Section {k}</a>' for k in range(30)]
+        parts.append("</nav><main>")
+        for _ in range(rnd.randint(40, 120)):
+            text = " ".join(rnd.choice(words) for _ in range(rnd.randint(20, 80)))
+            parts.append(f'<div class="block"><p>{text} '
+                         f'<a href="/page/{rnd.randrange(10**6)}">more</a> '
+                         f'<a rel="nofollow" href="/out/{rnd.randrange(10**6)}">ad</a></p>')
+            if rnd.random() < 0.3:
+                parts.append(f'<img src="/img/{rnd.randrange(5000)}.jpg" alt="x">')
+            if rnd.random() < 0.02:
+                parts.append(f'<video controls><source src="/v/{rnd.randrange(100)}.mp4"></video>')
+            parts.append("</div>")
+        parts.append("</main><footer>&copy; example</footer></body></html>")
+        with open(os.path.join(path, f"page_{i:04d}.html"), "w", encoding="utf-8") as f:
+            f.write("".join(parts))
+
+
+def run_one(name, corpus, repeat):
+    """Child process: time one extractor and report its peak memory."""
+    files = sorted(glob.glob(os.path.join(corpus, "*.html")))
+    docs  = []
+    for fn in files:
+        with open(fn, encoding="utf-8", errors="replace") as f:
+            docs.append(f.read())
+    extractor = get_extractor(name)
+    refs = 0
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for html in docs:
+            links, images, videos, canonical = extractor.extract(html)
+            refs += len(links) + len(images) + len(videos)
+    elapsed = time.perf_counter() - t0
+    # ru_maxrss is KiB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # separate, untimed pass: tracemalloc slows allocation down
+    parse_peak = 0
+    tracemalloc.start()
+    for html in docs:
+        tracemalloc.reset_peak()
+        extractor.extract(html)
+        parse_peak = max(parse_peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    print(json.dumps({
+        "name": name,
+        "pages": len(docs) * repeat,
+        "seconds": elapsed,
+        "refs": refs // repeat,
+        "peak_rss_kib": peak_rss,
+        "parse_peak_kib": parse_peak / 1024
+    }))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "sitemapz_bench_html"))
+    ap.add_argument("--pages", type=int, default=200,
+                    help="size of the synthetic corpus when one is generated")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--run", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.run:
+        return run_one(args.run, args.corpus, args.repeat)
+
+    if not glob.glob(os.path.join(args.corpus, "*.html")):
+        print(f"generating {args.pages} synthetic pages in {args.corpus}")
+        generate_corpus(args.corpus, args.pages)
+
+    print(f"{'extractor':<10} {'pages/sec':>10} {'peak RSS':>12} {'parse peak':>12} {'refs/pass':>10}")
+    for name in EXTRACTORS:
+        out = subprocess.run(
+            [sys.executable, __file__, "--run", name, "--corpus", args.corpus,
+             "--repeat", str(args.repeat)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        res = json.loads(out.strip().splitlines()[-1])
+        print(f"{name:<10} {res['pages'] / res['seconds']:>10.1f} "
+              f"{res['peak_rss_kib'] / 1024:>9.1f} MiB "
+              f"{res['parse_peak_kib']:>9.1f} KiB {res['refs']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Frontier benchmark on a synthetic link graph.
+
+Replays a crawl of N pages with F outlinks each (no network) through:
+  - list:  the old `to_visit` list + pop(0), dedup against `visited` on dequeue
+  - set:   Frontier (deque + seen set, dedup on enqueue)
+  - bloom: Frontier with a Bloom-filter seen set
+
+and reports wall time, peak frontier length and peak traced memory.
+
+    python benchmarks/bench_frontier.py --pages 20000 --fanout 20
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from frontier import Frontier
+
+
+def make_graph(pages, fanout, seed):
+    rnd  = random.Random(seed)
+    base = "https://example.com/page/"
+    urls = [f"{base}{i}" for i in range(pages)]
+    # links skew towards a small set of hubs, like menus and footers
+    hubs = urls[:max(1, pages // 100)]
+    graph = {}
+    for url in urls:
+        out = [rnd.choice(hubs) for _ in range(fanout // 2)]
+        out += [rnd.choice(urls) for _ in range(fanout - len(out))]
+        graph[url] = out
+    return urls[0], graph
+
+
+def crawl_list(start, graph, max_pages):
+    visited, to_visit = set(), [start]
+    fetched = peak = 0
+    while to_visit and fetched < max_pages:
+        url = to_visit.pop(0)
+        if url in visited:
+            continue
+        visited.add(url)
+        fetched += 1
+        for link in graph[url]:
+            if link not in visited:
+                to_visit.append(link)
+        peak = max(peak, len(to_visit))
+    return fetched, peak
+
+
+def crawl_frontier(start, graph, max_pages, bloom_capacity=None):
+    frontier = Frontier(bloom_capacity=bloom_capacity)
+    frontier.push(start)
+    fetched = peak = 0
+    while frontier and fetched < max_pages:
+        url = frontier.pop()
+        fetched += 1
+        for link in graph[url]:
+            frontier.push(link)
+        peak = max(peak, len(frontier))
+    return fetched, peak
+
+
+def measure(name, fn, *args):
+    # time and memory come from separate runs: tracemalloc skews timings
+    t0 = time.perf_counter()
+    fetched, peak_len = fn(*args)
+    elapsed = time.perf_counter() - t0
+    tracemalloc.start()
+    fn(*args)
+    _, peak_mem = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<6} fetched={fetched:>8} time={elapsed:8.3f}s "
+          f"peak_frontier={peak_len:>10} peak_mem={peak_mem / 2**20:8.1f} MiB")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--pages", type=int, default=20000)
+    ap.add_argument("--fanout", type=int, default=20)
+    ap.add_argument("--max-pages", type=int, default=None)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    start, graph = make_graph(args.pages, args.fanout, args.seed)
+    max_pages = args.max_pages or args.pages
+    print(f"graph: {args.pages} pages, fanout {args.fanout}, budget {max_pages}")
+
+    measure("list", crawl_list, start, graph, max_pages)
+    measure("set", crawl_frontier, start, graph, max_pages)
+    measure("bloom", crawl_frontier, start, graph, max_pages, args.pages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+End-to-end crawl pipeline benchmark against a local synthetic site.
+
+Serves a SyntheticSite (see synthetic_site.py) from this process and
+runs each stage in its own subprocess, so peak RSS is per stage:
+
+  crawl     SiteCrawler.crawl() of the whole site
+  scan      run_scan() into a throwaway SQLite database; run twice, the
+            second time after a share of the pages changed (incremental)
+  generate  generate_all() over the same number of synthetic URLs
+
+and reports wall time, pages/sec, peak RSS and, for scans, the DB and
+render time recorded in Scan.extra_info.
+
+    python benchmarks/bench_pipeline.py --pages 10000 --latency 0.002
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import tempfile
+import argparse
+import subprocess
+from datetime import datetime, timedelta
+from collections import namedtuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from synthetic_site import serve, add_site_arguments, site_from_args
+
+STAGES = ("crawl", "scan", "generate")
+
+# what run_scan streams into generate_all
+PageRow = namedtuple("PageRow", "url lastmod")
+
+
+def peak_rss_mib():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def output_mib(path):
+    return sum(os.path.getsize(os.path.join(path, fn))
+               for fn in os.listdir(path) if fn.endswith(".xml")) / 2**20
+
+
+def stage_crawl(args):
+    from crawler import SiteCrawler
+    t0 = time.perf_counter()
+    data = SiteCrawler(args.url, max_pages=args.budget, delay=0,
+                       concurrency=args.concurrency,
+                       extractor=args.extractor).crawl()
+    elapsed = time.perf_counter() - t0
+    return {"pages": len(data["pages"]), "seconds": elapsed}
+
+
+def stage_scan(args):
+    # settings are read at import time
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(args.workdir, 'bench.db')}",
+        "CRAWL_DELAY": "0",
+        "CRAWL_CONCURRENCY": str(args.concurrency),
+        "CRAWL_EXTRACTOR": args.extractor,
+        "CRAWL_MAX_PAGES": str(args.budget),
+        "CRAWL_CHECKPOINT_INTERVAL": "0",
+    })
+    os.chdir(args.workdir)
+    import scanner
+    from models import init_db, db_session, Website, Scan
+    scanner.send_report = lambda subject, body, to_addr=None: None
+
+    init_db()
+    session = db_session()
+    ws = session.query(Website).filter_by(url=args.url).one_or_none()
+    if ws is None:
+        ws = Website(url=args.url, cron_schedule="0 0 * * *", api_token="bench")
+        session.add(ws)
+        session.commit()
+
+    t0 = time.perf_counter()
+    scan_id = scanner.run_scan(ws.id)
+    elapsed = time.perf_counter() - t0
+
+    scan = db_session().get(Scan, scan_id)
+    if scan.errors:
+        raise RuntimeError(scan.errors)
+    info = scan.extra_info or {}
+    phases = info.get("metrics", {}).get("phases", {})
+    return {
+        "pages": scan.pages_found, "seconds": elapsed,
+        "db_seconds": phases.get("db"), "render_seconds": phases.get("render"),
+        "not_modified": info.get("not_modified", 0)
+    }
+
+
+def stage_generate(args):
+    from generator import generate_all
+    from media import MediaIndex
+    site = site_from_args(args)
+    now = datetime(2025, 1, 1)
+    pages = (PageRow(f"{args.url}/p/{i}", now - timedelta(minutes=i))
+             for i in sorted(range(args.pages), key=str))
+    # the media the crawler would have found on each page
+    media = MediaIndex()
+    for i in range(args.pages):
+        images, videos = site.media(i)
+        media.add(f"{args.url}/p/{i}", [args.url + p for p in images],
+                  [args.url + p for p in videos])
+    outdir = os.path.join(args.workdir, "generate")
+    t0 = time.perf_counter()
+    generate_all(1, "bench", outdir, pages, media.grouped("images"),
+                 media.grouped("videos"), compress=args.gzip,
+                 index_base=f"{args.url}/reports/site_1")
+    elapsed = time.perf_counter() - t0
+    return {"pages": args.pages, "seconds": elapsed,
+            "output_mib": output_mib(outdir)}
+
+
+def run_stage(args):
+    """Child process: run one stage and print its result as JSON."""
+    result = globals()[f"stage_{args.run}"](args)
+    result["peak_rss_mib"] = peak_rss_mib()
+    print(json.dumps(result))
+
+
+def spawn(stage, url, workdir, args):
+    cmd = [sys.executable, __file__, "--run", stage, "--url", url,
+           "--workdir", workdir, "--pages", str(args.pages),
+           "--budget", str(args.budget), "--concurrency", str(args.concurrency),
+           "--extractor", args.extractor]
+    if args.gzip:
+        cmd.append("--gzip")
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def report(label, res):
+    extra = ""
+    if res.get("db_seconds") is not None:
+        extra = (f" db={res['db_seconds']:.2f}s render={res['render_seconds']:.2f}s"
+                 f" 304s={res['not_modified']}")
+    if res.get("output_mib") is not None:
+        extra = f" xml={res['output_mib']:.1f} MiB"
+    print(f"{label:<18} {res['pages']:>8} {res['seconds']:>9.2f}s "
+          f"{res['pages'] / res['seconds']:>10.1f} {res['peak_rss_mib']:>9.1f} MiB{extra}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    add_site_arguments(ap)
+    ap.add_argument("--stages", default=",".join(STAGES),
+                    help="comma-separated subset of " + ",".join(STAGES))
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--extractor", default="stream")
+    ap.add_argument("--budget", type=int, default=0,
+                    help="crawler max_pages (default: 2x --pages, room for redirects and 404s)")
+    ap.add_argument("--gzip", action="store_true", help="also write .xml.gz sitemaps")
+    ap.add_argument("--workdir", help=argparse.SUPPRESS)
+    ap.add_argument("--url", help=argparse.SUPPRESS)
+    ap.add_argument("--run", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    args.budget = args.budget or 2 * args.pages
+
+    if args.run:
+        return run_stage(args)
+
+    stages = [s for s in args.stages.split(",") if s]
+    site = site_from_args(args)
+    workdir = tempfile.mkdtemp(prefix="sitemapz_bench_")
+    try:
+        with serve(site) as url:
+            print(f"site: {args.pages} pages, fanout {args.fanout}, "
+                  f"latency {args.latency * 1000:.1f} ms, validators {args.validators}")
+            print(f"{'stage':<18} {'pages':>8} {'time':>10} {'pages/sec':>10} {'peak RSS':>13}")
+            if "crawl" in stages:
+                report("crawl", spawn("crawl", url, workdir, args))
+            if "scan" in stages:
+                report("scan (full)", spawn("scan", url, workdir, args))
+                site.generation += 1
+                report("scan (incremental)", spawn("scan", url, workdir, args))
+            if "generate" in stages:
+                report("generate", spawn("generate", url, workdir, args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Synthetic website server for offline crawl benchmarks.
+
+Every response is derived from the page number and a few knobs, so a
+site of a million pages costs no memory and the same settings always
+produce the same site:
+
+  /p/<i>            page i; links to 2i+1 and 2i+2 (so every page is
+                    reachable from /) plus `fanout` pseudo-random pages
+  /r/<i>/<hops>     redirect chain ending at /p/<i>
+  /gone/<i>         404
+  /img/<n>.jpg      media (never fetched by the crawler)
+  /robots.txt, /sitemap.xml   robots file pointing at a sitemap of the
+                    first `sitemap_pages` pages
+
+Bumping `generation` changes the content (and validators) of a
+`change_ratio` share of the pages, to benchmark incremental rescans.
+
+    python benchmarks/synthetic_site.py --pages 100000 --port 8080
+"""
+import time
+import hashlib
+import argparse
+import threading
+from email.utils import formatdate
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Last-Modified of generation 0; each generation is one day later
+EPOCH = 1735689600    # 2025-01-01
+
+
+def _unit(*parts):
+    """Deterministic float in [0, 1) for the given key."""
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2**64
+
+
+class SyntheticSite:
+    def __init__(self, pages=1000, fanout=10, redirect_ratio=0.02,
+                 redirect_hops=2, not_found_ratio=0.01, images=3,
+                 image_pool=None, video_ratio=0.05, latency=0.0,
+                 validators="both", change_ratio=0.1, sitemap_pages=0,
+                 padding=2000):
+        self.pages           = pages
+        self.fanout          = fanout
+        self.redirect_ratio  = redirect_ratio    # share of links that redirect
+        self.redirect_hops   = redirect_hops
+        self.not_found_ratio = not_found_ratio   # share of pages with a broken link
+        self.images          = images            # <img> per page
+        # distinct image URLs across the site; repeats are shared assets
+        self.image_pool      = image_pool or max(1, pages // 2)
+        self.video_ratio     = video_ratio       # share of pages with a <video>
+        self.latency         = latency           # seconds slept per request
+        self.validators      = validators        # "etag", "last-modified", "both", "none"
+        self.change_ratio    = change_ratio
+        self.sitemap_pages   = sitemap_pages
+        self.padding         = padding           # filler text bytes per page
+        self.generation      = 0
+
+    def version(self, i):
+        """Last generation in which page i changed."""
+        for g in range(self.generation, 0, -1):
+            if _unit("change", i, g) < self.change_ratio:
+                return g
+        return 0
+
+    def link(self, i):
+        if _unit("redirect", i) < self.redirect_ratio:
+            return f"/r/{i}/{self.redirect_hops}"
+        return f"/p/{i}"
+
+    def media(self, i):
+        """Image and video paths on page i."""
+        images = [f"/img/{int(_unit('img', i, k) * self.image_pool)}.jpg"
+                  for k in range(self.images)]
+        videos = [f"/video/{i}.mp4"] if _unit("video", i) < self.video_ratio else []
+        return images, videos
+
+    def page(self, i):
+        version = self.version(i)
+        links = [2 * i + 1, 2 * i + 2]
+        links += [int(_unit("link", i, k) * self.pages) for k in range(self.fanout)]
+        parts = [f"<!doctype html><html><head><title>Page {i}</title></head><body><nav>"]
+        parts += [f'<a href="{self.link(j)}">{j}</a>' for j in links if j < self.pages]
+        if _unit("gone", i) < self.not_found_ratio:
+            parts.append(f'<a href="/gone/{i}">old</a>')
+        parts.append("</nav><main>")
+        images, videos = self.media(i)
+        parts += [f'<img src="{src}" alt="">' for src in images]
+        parts += [f'<video src="{src}"></video>' for src in videos]
+        parts.append(f"<p>version {version} " + "x" * self.padding + "</p>")
+        parts.append("</main></body></html>")
+        return "".join(parts).encode(), version
+
+    def sitemap(self, base):
+        urls = "".join(f"<url><loc>{base}/p/{i}</loc></url>"
+                       for i in range(min(self.sitemap_pages, self.pages)))
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                f"{urls}</urlset>").encode()
+
+
+def make_handler(site):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body go out in separate writes; without this,
+        # delayed ACKs stall every keep-alive response by ~40 ms
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if site.latency:
+                time.sleep(site.latency)
+            path = self.path.split("?", 1)[0]
+            parts = path.strip("/").split("/")
+            try:
+                if path in ("/", ""):
+                    return self.page(0)
+                if parts[0] == "p" and len(parts) == 2:
+                    return self.page(int(parts[1]))
+                if parts[0] == "r" and len(parts) == 3:
+                    i, hops = int(parts[1]), int(parts[2])
+                    target = f"/r/{i}/{hops - 1}" if hops > 1 else f"/p/{i}"
+                    return self.send(301, b"", headers={"Location": target})
+                if path == "/robots.txt":
+                    host = self.headers.get("Host")
+                    body = f"User-agent: *\nAllow: /\nSitemap: http://{host}/sitemap.xml\n"
+                    return self.send(200, body.encode(), "text/plain")
+                if path == "/sitemap.xml" and site.sitemap_pages:
+                    body = site.sitemap(f"http://{self.headers.get('Host')}")
+                    return self.send(200, body, "application/xml")
+            except ValueError:
+                pass
+            self.send(404, b"not found")
+
+        def page(self, i):
+            if not 0 <= i < site.pages:
+                return self.send(404, b"not found")
+            body, version = site.page(i)
+            headers = {}
+            etag = f'"{i}-{version}"'
+            last_modified = formatdate(EPOCH + version * 86400, usegmt=True)
+            if site.validators in ("etag", "both"):
+                headers["ETag"] = etag
+                if self.headers.get("If-None-Match") == etag:
+                    return self.send(304, b"", headers=headers)
+            if site.validators in ("last-modified", "both"):
+                headers["Last-Modified"] = last_modified
+                if (self.headers.get("If-Modified-Since") == last_modified
+                        and "If-None-Match" not in self.headers):
+                    return self.send(304, b"", headers=headers)
+            self.send(200, body, headers=headers)
+
+        def send(self, code, body, ctype="text/html", headers=None):
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if body and code != 304:
+                self.wfile.write(body)
+
+    return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+@contextmanager
+def serve(site, host="127.0.0.1", port=0):
+    """Run `site` on a background thread; yields its base URL."""
+    server = _Server((host, port), make_handler(site))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://{host}:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def add_site_arguments(ap):
+    ap.add_argument("--pages", type=int, default=1000)
+    ap.add_argument("--fanout", type=int, default=10)
+    ap.add_argument("--redirect-ratio", type=float, default=0.02)
+    ap.add_argument("--redirect-hops", type=int, default=2)
+    ap.add_argument("--not-found-ratio", type=float, default=0.01)
+    ap.add_argument("--images", type=int, default=3)
+    ap.add_argument("--video-ratio", type=float, default=0.05)
+    ap.add_argument("--latency", type=float, default=0.0)
+    ap.add_argument("--validators", default="both",
+                    choices=("etag", "last-modified", "both", "none"))
+    ap.add_argument("--change-ratio", type=float, default=0.1)
+    ap.add_argument("--sitemap-pages", type=int, default=0)
+
+
+def site_from_args(args):
+    return SyntheticSite(
+        pages=args.pages, fanout=args.fanout,
+        redirect_ratio=args.redirect_ratio, redirect_hops=args.redirect_hops,
+        not_found_ratio=args.not_found_ratio, images=args.images,
+        video_ratio=args.video_ratio, latency=args.latency,
+        validators=args.validators, change_ratio=args.change_ratio,
+        sitemap_pages=args.sitemap_pages
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    add_site_arguments(ap)
+    ap.add_argument("--port", type=int, default=8080)
+    args = ap.parse_args()
+    with serve(site_from_args(args), port=args.port) as url:
+        print(f"serving {args.pages} pages on {url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import time
+import threading
+
+
+class TTLCache:
+    """
+    Small thread-safe cache for read views: entries expire `ttl` seconds
+    after being stored, and the oldest one is evicted beyond `maxsize`.
+    Lets views be served across processes that can't invalidate it
+    (e.g. scans run by scheduler.py) with bounded staleness.
+    """
+    def __init__(self, ttl, maxsize=256):
+        self.ttl     = ttl
+        self.maxsize = maxsize
+        self._data   = {}    # key -> (expires, value), in insertion order
+        self._lock   = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self._data[key]
+                return None
+            return item[1]
+
+    def set(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            while len(self._data) > self.maxsize:
+                del self._data[next(iter(self._data))]
+
+    def invalidate(self, match=None):
+        """Drop every entry, or those whose key satisfies `match(key)`."""
+        with self._lock:
+            if match is None:
+                self._data.clear()
+                return
+            for key in [k for k in self._data if match(k)]:
+                del self._data[key]
@@ -1,22 +1,256 @@
+import os
 import time
+import gzip
+import heapq
+import pickle
+import random
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from urllib.parse import urljoin, urlparse
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
 from datetime import datetime, timezone
 from email.utils import parsedate_to_datetime
 import hashlib
 
+from frontier import Frontier
+from media import MediaIndex
+from pagestore import PageStore
+from metrics import ScanStats
+from seeds import parse_robots, allow_all_robots, iter_sitemap
+from extractors import LinkExtractor, get_extractor
+
+# bump when the checkpoint layout changes; older files are ignored
+CHECKPOINT_VERSION = 6
+
+# sent with every request and matched against robots.txt groups
+USER_AGENT = "SitemapzBot/1.0"
+
+# gzip/deflate always; br (and zstd) when a decoder is installed
+ACCEPT_ENCODING = make_headers(accept_encoding=True)["accept-encoding"]
+
+# answers worth asking again later; 429/503 also slow the crawl down
+RETRY_STATUSES    = (429, 500, 502, 503, 504)
+OVERLOAD_STATUSES = (429, 503)
+# longest Retry-After honored (seconds), as a host pause and as the
+# delay of a retry; a page asked to wait longer fails as "retry_after"
+MAX_RETRY_AFTER   = 120
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class FetchFailed(Exception):
+    """A fetch that gave no page record. Retryable ones are tried again later."""
+    def __init__(self, reason, retryable=False, retry_after=None):
+        super().__init__(reason)
+        self.reason      = reason
+        self.retryable   = retryable
+        self.retry_after = retry_after
+
+
+def make_session(pool_size):
+    """
+    Pooled, keep-alive HTTP session: up to `pool_size` connections are
+    kept open per host and reused across requests and worker threads.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_size,
+                          pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+class HostThrottle:
+    """
+    Per-host politeness: request starts against the same host are spaced
+    at least `delay` seconds apart, whatever the number of workers, with
+    at most `limit` requests in flight. A Retry-After pauses the host.
+    """
+    def __init__(self, delay, limit=1):
+        self.delay     = delay
+        self.min_delay = delay
+        self.limit     = limit
+        self._next = {}    # host -> earliest monotonic time for next request
+        self._lock = threading.Lock()
+
+    def observe(self, latency):
+        """Response time of a successful request."""
+
+    def backoff(self, url, retry_after=None):
+        """The server is overloaded (429/503)."""
+        if retry_after:
+            host = urlparse(url).netloc
+            with self._lock:
+                resume = time.monotonic() + min(retry_after, MAX_RETRY_AFTER)
+                self._next[host] = max(self._next.get(host, 0.0), resume)
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now   = time.monotonic()
+            start = max(now, self._next.get(host, now))
+            self._next[host] = start + self.delay
+        if start > now:
+            time.sleep(start - now)
+
+
+class AdaptiveThrottle(HostThrottle):
+    """
+    HostThrottle whose delay and concurrency follow the server, AIMD
+    style. After `limit` fast responses in a row the delay is halved,
+    down to min_delay, and once there one more request may be in flight
+    (up to max_limit). A slow response (smoothed latency over
+    `slow_factor` times the best seen), a 429 or a 503 halves the limit,
+    or doubles the delay (up to max_delay) when the limit is already 1.
+    One decrease per `calm` seconds at most: the other answers to
+    requests sent at the old rate are not counted again.
+    """
+    def __init__(self, delay, max_limit, min_delay=0.0, max_delay=30.0,
+                 slow_factor=3.0, calm=1.0):
+        super().__init__(delay, limit=1)
+        self.min_delay   = min_delay
+        self.max_delay   = max_delay
+        self.max_limit   = max_limit
+        self.slow_factor = slow_factor
+        self.calm        = calm
+        self.latency     = None    # smoothed (EWMA) response time
+        self.best        = None    # lowest smoothed response time seen
+        self._good       = 0       # fast responses since the last change
+        self._calm_until = 0.0     # monotonic time of the next allowed decrease
+
+    def observe(self, latency):
+        with self._lock:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency = 0.8 * self.latency + 0.2 * latency
+            self.best = self.latency if self.best is None else min(self.best, self.latency)
+            # below 10 ms everything is noise
+            if self.latency > self.slow_factor * max(self.best, 0.01):
+                self._decrease()
+                return
+            self._good += 1
+            if self._good < self.limit:
+                return
+            self._good = 0
+            if self.delay > self.min_delay:
+                self.delay = self.delay / 2 if self.delay / 2 > 0.005 else 0.0
+                self.delay = max(self.min_delay, self.delay)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1)
+
+    def backoff(self, url, retry_after=None):
+        super().backoff(url, retry_after)
+        with self._lock:
+            self._decrease()
+
+    def _decrease(self):
+        now = time.monotonic()
+        self._good = 0
+        if now < self._calm_until:
+            return
+        self._calm_until = now + max(self.calm, 4 * (self.latency or 0.0))
+        if self.limit > 1:
+            self.limit //= 2
+        else:
+            self.delay = min(self.max_delay, max(self.delay * 2, 0.1, self.min_delay))
+
+
 class SiteCrawler:
-    def __init__(self, base_url, max_pages=10000, delay=0.5):
+    def __init__(self, base_url, max_pages=10000, delay=0.5, concurrency=1,
+                 bloom_capacity=None, previous=None, link_cache=None,
+                 extractor="stream", pool_size=None, on_result=None,
+                 checkpoint_path=None, checkpoint_interval=60,
+                 checkpoint_max_age=24 * 3600, seed=False, prioritize=False,
+                 robots=False, changed=None, max_sitemaps=50, stats=None,
+                 redirects=None, adaptive=False, min_delay=0.0, max_delay=30.0,
+                 max_retries=3, retry_backoff=1.0, max_retry_queue=1000):
         self.base_url   = base_url.rstrip('/')
         self.parsed_base = urlparse(self.base_url)
-        self.visited    = set()
-        self.to_visit   = [self.base_url]
-        self.pages      = []    # will hold dicts
-        self.images     = set()
-        self.videos     = set()
+        # every URL ever queued; doubles as the visited set
+        self.frontier   = Frontier(bloom_capacity=bloom_capacity,
+                                   prioritized=prioritize)
+        self.frontier.push(self.base_url)
+        # page records, as compact columns (see pagestore.py)
+        self.pages      = PageStore(self.base_url)
+        # images and videos by the page they were found on
+        self.media      = MediaIndex()
         self.max_pages  = max_pages
         self.delay      = delay
+        self.concurrency = max(1, int(concurrency))
+        # adaptive: `delay` is where the delay starts, `concurrency` the
+        # most requests ever in flight
+        if adaptive:
+            self.throttle = AdaptiveThrottle(delay, self.concurrency,
+                                             min_delay=min_delay, max_delay=max_delay)
+        else:
+            self.throttle = HostThrottle(delay, self.concurrency)
+        # failed fetches are retried up to max_retries times, after
+        # retry_backoff * 2^n seconds; past max_retry_queue pending
+        # retries, or for good, they end up in `failed`
+        self.max_retries     = max_retries
+        self.retry_backoff   = retry_backoff
+        self.max_retry_queue = max_retry_queue
+        self.attempts   = {}    # url -> failed attempts so far
+        self.failed     = []    # {loc, reason, attempts}
+        self._retry_seq = itertools.count()
+        # connections kept alive per host; one per worker by default
+        self.session    = make_session(pool_size or self.concurrency)
+        # called with every page record as soon as it is known
+        self.on_result  = on_result
+        # incremental mode: url -> {etag, last_modified, lastmod, hash}
+        # from the previous scan
+        self.previous   = previous
+        # content hash -> {links, images, videos}; pages whose body hash is
+        # known are not parsed again. Filled in as new bodies are parsed.
+        self.link_cache = link_cache
+        # LinkExtractor instance or registered name ("stream", "soup")
+        if not isinstance(extractor, LinkExtractor):
+            extractor = get_extractor(extractor)
+        self.extractor  = extractor
+        # crawl state is saved there every `checkpoint_interval` seconds
+        # and picked up again by the next crawl of the same site
+        self.checkpoint_path     = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_max_age  = checkpoint_max_age
+        # seed the frontier from robots.txt Sitemap: lines / sitemap.xml
+        self.seed       = seed
+        self.max_sitemaps = max_sitemaps
+        # honor Disallow and Crawl-delay
+        self.obey_robots = robots
+        self.robots     = None
+        # URLs that changed last time; crawled first within their depth
+        self.changed    = changed or set()
+        # fetch/parse histograms and per-status counters
+        self.stats      = stats or ScanStats()
+        # known redirects: url -> {target, hops, status}; replayed
+        # without a request, straight to the end of the chain
+        self.redirects  = redirects or {}
+        # wall-clock start of the crawl, carried over by checkpoints so
+        # their age is that of the data, not of the last save
+        self.started_at = None
+        # set when the restored checkpoint was of a finished crawl
+        self.finished   = False
 
     def is_internal(self, link):
         p = urlparse(link)
@@ -26,85 +260,442 @@ class SiteCrawler:
         # strip hashes, make absolute, strip trailing slash
         return urljoin(self.base_url, link.split('#')[0]).rstrip('/')
 
-    def crawl(self):
-        results = []
+    def known_links(self, body_hash):
+        if self.link_cache is None or not body_hash:
+            return None
+        return self.link_cache.get(body_hash)
 
-        while self.to_visit and len(results) < self.max_pages:
-            url = self.to_visit.pop(0)
-            if url in self.visited:
-                continue
-            self.visited.add(url)
+    def extract(self, html):
+        """
+        Return the internal links, images and videos found in `html`, and
+        its rel=canonical URL when internal.
+        """
+        hrefs, srcs, video_srcs, canonical = self.extractor.extract(html)
+        links = []
+        for href in hrefs:
+            link = self.normalize(href)
+            if self.is_internal(link):
+                links.append(link)
 
-            try:
-                # no auto-redirects so we can catch 301/302
-                r = requests.get(url, timeout=10, allow_redirects=False)
-                code = r.status_code
-
-                # 404 → record broken, skip indexing
-                if code == 404:
-                    results.append({
-                        "loc": url,
-                        "status": 404,
-                        "lastmod": None,
-                        "redirect_to": None
-                    })
-                    continue
+        images = [self.normalize(src) for src in srcs]
+        videos = [self.normalize(src) for src in video_srcs]
+        if canonical:
+            canonical = self.normalize(canonical)
+            if not self.is_internal(canonical):
+                canonical = None
+        return links, images, videos, canonical
 
-                # redirects → enqueue target, record original as redirect
-                if 300 <= code < 400 and "Location" in r.headers:
-                    target = self.normalize(r.headers["Location"])
-                    if self.is_internal(target) and target not in self.visited:
-                        self.to_visit.append(target)
-                    results.append({
-                        "loc": url,
-                        "status": code,
-                        "lastmod": None,
-                        "redirect_to": target
-                    })
-                    continue
+    def replay(self, known):
+        """
+        extract() for a link cache entry: its links, images, videos and
+        canonical held to the same rules, so nothing outside this site
+        is ever followed from a cached entry.
+        """
+        links = [link for link in map(self.normalize, known["links"])
+                 if self.is_internal(link)]
+        images = [self.normalize(src) for src in known["images"]]
+        videos = [self.normalize(src) for src in known["videos"]]
+        canonical = known.get("canonical")
+        if canonical:
+            canonical = self.normalize(canonical)
+            if not self.is_internal(canonical):
+                canonical = None
+        return links, images, videos, canonical
 
-                # 200 OK (or other 2xx)
-                r.raise_for_status()
-                body_hash = hashlib.sha256(r.content).hexdigest()
-                # parse Last-Modified header if present
-                lm = r.headers.get("Last-Modified")
-                dt = None
-                if lm:
-                    try:
-                        dt = parsedate_to_datetime(lm).astimezone(timezone.utc)
-                    except Exception:
-                        dt = None
+    def conditional_headers(self, prev):
+        # only revalidate when the outgoing links can be replayed on a 304
+        headers = {}
+        if prev and self.known_links(prev.get("hash")) is not None:
+            if prev.get("etag"):
+                headers["If-None-Match"] = prev["etag"]
+            if prev.get("last_modified"):
+                headers["If-Modified-Since"] = prev["last_modified"]
+        return headers
 
-                # record this page
-                results.append({
+    def fetch(self, url):
+        """
+        Fetch and parse a single URL. Runs on a worker thread, so it only
+        reads crawler configuration and never touches the frontier.
+        Returns (record, links, images, videos); raises FetchFailed.
+        """
+        cached = self.redirects.get(url)
+        if cached:
+            self.stats.inc("redirects", "replayed")
+            target = cached["target"]
+            return {
+                "loc": url,
+                "status": cached["status"],
+                "lastmod": None,
+                "redirect_to": target,
+                "hops": cached["hops"],
+                "redirect_cached": True
+            }, [target] if self.is_internal(target) else [], [], []
+        try:
+            prev = self.previous.get(url) if self.previous is not None else None
+            self.throttle.wait(url)
+            start = time.perf_counter()
+            # no auto-redirects so we can catch 301/302
+            r = self.session.get(url, timeout=10, allow_redirects=False,
+                                 headers=self.conditional_headers(prev))
+            code = r.status_code
+            # the body is read by get(); r.elapsed stops at the headers
+            self.stats.observe("fetch_seconds", time.perf_counter() - start)
+            self.stats.observe("response_seconds", r.elapsed.total_seconds())
+            self.stats.observe("response_bytes", len(r.content))
+            self.stats.inc("status", code)
+
+            # overloaded or failing server → try again later
+            if code in RETRY_STATUSES:
+                retry_after = parse_retry_after(r.headers.get("Retry-After"))
+                if code in OVERLOAD_STATUSES:
+                    self.throttle.backoff(url, retry_after)
+                raise FetchFailed(str(code), retryable=True, retry_after=retry_after)
+            self.throttle.observe(r.elapsed.total_seconds())
+
+            # 304 → unchanged since the previous scan, replay what we knew
+            if code == 304 and prev:
+                links, images, videos, canonical = self.replay(
+                    self.known_links(prev["hash"]))
+                return {
                     "loc": url,
-                    "status": code,
-                    "lastmod": dt,
+                    "status": 200,
+                    "lastmod": prev["lastmod"],
                     "redirect_to": None,
-                    "hash": body_hash
-                })
-
-                # extract further internal links
-                soup = BeautifulSoup(r.text, "html.parser")
-                for a in soup.find_all('a', href=True):
-                    link = self.normalize(a['href'])
-                    if link not in self.visited and self.is_internal(link):
-                        self.to_visit.append(link)
-
-                # images
-                for img in soup.find_all('img', src=True):
-                    self.images.add(self.normalize(img['src']))
-                # videos/sources
-                for vid in soup.find_all(['video', 'source'], src=True):
-                    self.videos.add(self.normalize(vid['src']))
-
-                time.sleep(self.delay)
+                    "hash": prev["hash"],
+                    "etag": r.headers.get("ETag", prev.get("etag")),
+                    "last_modified": r.headers.get("Last-Modified", prev.get("last_modified")),
+                    "canonical": canonical,
+                    "not_modified": True
+                }, links, images, videos
+
+            # 404 → record broken, skip indexing
+            if code == 404:
+                return {
+                    "loc": url,
+                    "status": 404,
+                    "lastmod": None,
+                    "redirect_to": None
+                }, [], [], []
+
+            # redirects → enqueue target, record original as redirect
+            if 300 <= code < 400 and "Location" in r.headers:
+                target = self.normalize(r.headers["Location"])
+                links = [target] if self.is_internal(target) else []
+                return {
+                    "loc": url,
+                    "status": code,
+                    "lastmod": None,
+                    "redirect_to": target
+                }, links, [], []
+
+            # other errors (403, 410, ...) won't get better by asking again
+            if code >= 400:
+                raise FetchFailed(str(code))
+
+            # 200 OK (or other 2xx)
+            body_hash = hashlib.sha256(r.content).hexdigest()
+            # parse Last-Modified header if present
+            lm = r.headers.get("Last-Modified")
+            dt = None
+            if lm:
+                try:
+                    dt = parsedate_to_datetime(lm).astimezone(timezone.utc)
+                except Exception:
+                    dt = None
+
+            record = {
+                "loc": url,
+                "status": code,
+                "lastmod": dt,
+                "redirect_to": None,
+                "hash": body_hash,
+                "etag": r.headers.get("ETag"),
+                "last_modified": lm
+            }
+
+            # same body as a page we already parsed → replay its links
+            known = self.known_links(body_hash)
+            if known is not None:
+                links, images, videos, canonical = self.replay(known)
+                record["links_replayed"] = True
+                record["canonical"] = canonical
+                return record, links, images, videos
+
+            # extract further internal links
+            with self.stats.timer("parse_seconds"):
+                links, images, videos, canonical = self.extract(r.text)
+            if canonical and canonical != url:
+                # crawl it too: the page collapses into it if it is listed
+                record["canonical"] = canonical
+                links.append(canonical)
+
+            if self.link_cache is not None:
+                outlinks = {
+                    "links": list(dict.fromkeys(links)),
+                    "images": list(dict.fromkeys(images)),
+                    "videos": list(dict.fromkeys(videos)),
+                    "canonical": record.get("canonical")
+                }
+                self.link_cache[body_hash] = outlinks
+                # new to the cache: run_scan persists it with the page
+                record["outlinks"] = outlinks
+
+            return record, links, images, videos
+        except FetchFailed:
+            raise
+        except (requests.ConnectionError, requests.Timeout) as e:
+            self.stats.inc("errors", type(e).__name__)
+            raise FetchFailed(type(e).__name__, retryable=True)
+        except Exception as e:
+            # parse errors, etc.
+            self.stats.inc("errors", type(e).__name__)
+            raise FetchFailed(type(e).__name__)
+
+    def retry_later(self, retries, url, depth, error):
+        """
+        Queue a failed fetch for another attempt (exponential backoff,
+        with jitter, or the server's Retry-After if longer; at most
+        MAX_RETRY_AFTER), or record it as failed for good.
+        """
+        attempt = self.attempts.get(url, 0) + 1
+        reason = error.reason
+        if (error.retry_after or 0.0) > MAX_RETRY_AFTER:
+            # the crawl would stall waiting for it
+            reason = "retry_after"
+        if (reason != error.reason or not error.retryable or attempt > self.max_retries
+                or len(retries) >= self.max_retry_queue):
+            self.failed.append({"loc": url, "reason": reason, "attempts": attempt})
+            self.stats.inc("failures", reason)
+            return
+        self.attempts[url] = attempt
+        wait_s = self.retry_backoff * 2 ** (attempt - 1) * random.uniform(1.0, 1.5)
+        wait_s = min(max(wait_s, error.retry_after or 0.0), MAX_RETRY_AFTER)
+        heapq.heappush(retries, (time.monotonic() + wait_s, next(self._retry_seq), url, depth))
+        self.stats.inc("retries", error.reason)
+
+    # ─── robots.txt & sitemap seeding ───────────────────────────────
+    def load_robots(self):
+        """Fetch robots.txt; apply its Crawl-delay when obeying it."""
+        url = self.base_url + "/robots.txt"
+        try:
+            self.throttle.wait(url)
+            r = self.session.get(url, timeout=10)
+            # no robots.txt (or an unreadable one) means no restrictions
+            ok = r.status_code == 200
+            self.robots = parse_robots(r.text, url) if ok else allow_all_robots()
+        except Exception:
+            self.robots = allow_all_robots()
+        if self.obey_robots:
+            crawl_delay = self.robots.crawl_delay(USER_AGENT)
+            if crawl_delay:
+                self.throttle.delay = max(self.throttle.delay, float(crawl_delay))
+                self.throttle.min_delay = max(self.throttle.min_delay, float(crawl_delay))
+
+    def allowed(self, url):
+        return self.robots is None or self.robots.can_fetch(USER_AGENT, url)
+
+    def is_changed(self, url, lastmod):
+        """Known to have changed: last scan said so, or the sitemap's lastmod moved."""
+        if url in self.changed:
+            return True
+        prev = self.previous.get(url) if self.previous is not None else None
+        if not (lastmod and prev and prev.get("lastmod")):
+            return False
+        try:
+            return lastmod > prev["lastmod"]
+        except TypeError:
+            # naive vs aware datetime
+            return False
+
+    def seed_from_sitemaps(self):
+        """
+        Queue the pages listed in the site's own sitemaps (the robots.txt
+        Sitemap: lines, else /sitemap.xml), following sitemap indexes.
+        Seeds get depth 1, like links from the home page, so pages only
+        reachable through the sitemap are found too. Returns the number
+        of URLs queued.
+        """
+        pending = list(self.robots.site_maps() or []) if self.robots else []
+        if not pending:
+            pending = [self.base_url + "/sitemap.xml"]
+        fetched, added = set(), 0
+        while pending and len(fetched) < self.max_sitemaps and added < self.max_pages:
+            sitemap = pending.pop(0)
+            if sitemap in fetched:
+                continue
+            fetched.add(sitemap)
+            try:
+                self.throttle.wait(sitemap)
+                r = self.session.get(sitemap, timeout=30)
+                if r.status_code != 200:
+                    continue
+                for kind, loc, lastmod in iter_sitemap(r.content):
+                    if kind == "sitemap":
+                        pending.append(loc)
+                        continue
+                    if not self.is_internal(loc):
+                        continue
+                    url = self.normalize(loc)
+                    if self.frontier.push(url, 1, self.is_changed(url, lastmod)):
+                        added += 1
+                        if added >= self.max_pages:
+                            break
             except Exception:
-                # network errors, parse errors, etc.
+                # missing or malformed sitemap: links alone will do
                 continue
+        return added
+
+    # ─── checkpoints ────────────────────────────────────────────────
+    def save_checkpoint(self, results, in_flight, finished=False):
+        """
+        Write the frontier, the page records so far, the media index and
+        the failed fetches to `checkpoint_path`. Entries being fetched (or
+        waiting for a retry) right now are stored at the head of the
+        queue so they are fetched again on resume.
+        """
+        state = {
+            "version":   CHECKPOINT_VERSION,
+            "base_url":  self.base_url,
+            "started":   self.started_at,
+            "finished":  finished,
+            "frontier":  self.frontier,
+            "in_flight": list(in_flight),
+            "pages":     results,
+            "media":     self.media,
+            "failed":    self.failed
+        }
+        tmp = self.checkpoint_path + ".tmp"
+        with gzip.open(tmp, "wb", compresslevel=1) as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.checkpoint_path)
+
+    def restore_checkpoint(self):
+        """
+        Load the state saved by an interrupted crawl of this site, if any.
+        Returns the PageStore of records it had collected, or None when
+        there is nothing (usable) to resume from. Its age is counted from
+        the start of the crawl that wrote it, however often it was saved.
+        """
+        path = self.checkpoint_path
+        if not path or not os.path.isfile(path):
+            return None
+        # the file is never older than the crawl: skip loading a stale one
+        if (self.checkpoint_max_age
+                and time.time() - os.path.getmtime(path) > self.checkpoint_max_age):
+            return None
+        try:
+            with gzip.open(path, "rb") as f:
+                state = pickle.load(f)
+        except Exception:
+            # truncated or unreadable: start over
+            return None
+        if (state.get("version") != CHECKPOINT_VERSION
+                or state.get("base_url") != self.base_url):
+            return None
+        if (self.checkpoint_max_age
+                and time.time() - state["started"] > self.checkpoint_max_age):
+            return None
+        self.started_at = state["started"]
+        self.finished   = state["finished"]
+        self.frontier = state["frontier"]
+        self.frontier.requeue(state["in_flight"])
+        self.media    = state["media"]
+        self.failed   = state["failed"]
+        return state["pages"]
+
+    def crawl(self):
+        results = self.restore_checkpoint() or self.pages
+        resumed = len(results)
+        if self.started_at is None:
+            self.started_at = time.time()
+        if self.seed or self.obey_robots:
+            self.load_robots()
+        if self.seed and not resumed:
+            self.seed_from_sitemaps()
+        if self.on_result:
+            for record in results:
+                self.on_result(record)
+        last_checkpoint = time.monotonic()
+        started = time.perf_counter()
+
+        # the frontier, retries and results are only touched from this
+        # thread; workers just fetch and parse. The pool is sized for the
+        # most requests ever in flight; the throttle's limit decides how
+        # many actually are.
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            in_flight = {}
+            retries   = []    # heap of (monotonic time due, seq, url, depth)
+            while self.frontier or in_flight or retries:
+                if (self.checkpoint_path and self.checkpoint_interval
+                        and time.monotonic() - last_checkpoint >= self.checkpoint_interval):
+                    pending = list(in_flight.values()) + [(u, d) for _, _, u, d in retries]
+                    self.save_checkpoint(results, pending)
+                    last_checkpoint = time.monotonic()
+
+                while (len(in_flight) < self.throttle.limit
+                       and len(results) + len(in_flight) < self.max_pages):
+                    if retries and retries[0][0] <= time.monotonic():
+                        _, _, url, depth = heapq.heappop(retries)
+                    elif self.frontier:
+                        url, depth = self.frontier.pop_entry()
+                        if self.obey_robots and not self.allowed(url):
+                            continue
+                    else:
+                        break
+                    in_flight[pool.submit(self.fetch, url)] = (url, depth)
+
+                if not in_flight:
+                    if not retries or len(results) >= self.max_pages:
+                        break
+                    # nothing to do until the next retry is due
+                    time.sleep(max(0.0, retries[0][0] - time.monotonic()))
+                    continue
+
+                # wake up for the next retry, if there is room to start it
+                timeout = None
+                if (retries and len(in_flight) < self.throttle.limit
+                        and len(results) + len(in_flight) < self.max_pages):
+                    timeout = max(0.0, retries[0][0] - time.monotonic())
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    url, depth = in_flight.pop(fut)
+                    try:
+                        outcome = fut.result()
+                    except FetchFailed as e:
+                        self.retry_later(retries, url, depth, e)
+                        continue
+                    record, links, images, videos = outcome
+                    results.append(record)
+                    if self.on_result:
+                        self.on_result(record)
+                    for link in links:
+                        self.frontier.push(link, depth + 1, link in self.changed)
+                    self.media.add(record["loc"], images, videos)
 
+        self.session.close()
+        elapsed = time.perf_counter() - started
+        self.stats.set("crawl_seconds", round(elapsed, 3))
+        self.stats.set("pages_per_sec",
+                       round((len(results) - resumed) / elapsed, 2) if elapsed else 0.0)
+        # where the throttle ended up
+        self.stats.set("concurrency_limit", self.throttle.limit)
+        self.stats.set("delay_seconds", round(self.throttle.delay, 3))
+        self.stats.set("failed_pages", len(self.failed))
+        if self.checkpoint_path and not self.finished:
+            # a finished crawl is kept too, so a scan that fails while
+            # persisting does not crawl the whole site again (until it
+            # is checkpoint_max_age old)
+            self.save_checkpoint(results, (), finished=True)
+        self.pages = results
         return {
             "pages": results,
-            "images": list(self.images),
-            "videos": list(self.videos)
+            "images": self.media.distinct("images"),
+            "videos": self.media.distinct("videos"),
+            # the same media grouped by page, for the sitemaps
+            "media": self.media,
+            # URLs that could not be fetched, even after retries
+            "failed": self.failed,
+            # records taken over from a checkpoint instead of fetched
+            "resumed": resumed,
+            "stats": self.stats.to_dict()
         }
@@ -0,0 +1,60 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+from models import db_session
+
+
+class DBWriter:
+    """
+    Single thread through which scans write to the database.
+
+    Jobs run one after another, each in one short transaction on the
+    writer's own (thread-local) db_session: functions that use
+    models.db_session just work when handed to run(). Parallel scans
+    then queue up here instead of fighting over SQLite's write lock,
+    and no transaction stays open while a site is being crawled or its
+    sitemaps rendered.
+    """
+    def __init__(self):
+        self._jobs   = queue.Queue()
+        self._thread = None
+        self._lock   = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs); returns a Future of its result."""
+        self._ensure_started()
+        future = Future()
+        self._jobs.put((future, fn, args, kwargs))
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        """submit() and wait: the job's result, or its exception re-raised."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="db-writer",
+                                                daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            future, fn, args, kwargs = self._jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            session = db_session()
+            try:
+                result = fn(*args, **kwargs)
+                session.commit()
+            except BaseException as e:
+                session.rollback()
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                db_session.remove()
+
+
+writer = DBWriter()
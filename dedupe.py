@@ -0,0 +1,86 @@
+# Post-crawl clean-up of page records: redirect chains resolved to their
+# final URL, and pages that duplicate another one (same body, or a
+# rel=canonical pointing at it) collapsed into it.
+
+# longer chains are treated like loops (browsers give up around 20)
+MAX_REDIRECT_HOPS = 10
+
+# cached by the crawler across scans; temporary redirects are re-fetched
+PERMANENT_REDIRECTS = (301, 308)
+
+
+def is_redirect(p):
+    return 300 <= p["status"] < 400 and bool(p.get("redirect_to"))
+
+
+def resolve_redirects(pages, max_hops=MAX_REDIRECT_HOPS):
+    """
+    Follow every redirect record of a crawl to the end of its chain.
+    Returns ({source -> (final URL, hops)}, {"resolved": n, "loops": n});
+    sources whose chain loops or exceeds `max_hops` map to None. Hand
+    the chains to PageStore.resolve to update the records.
+    """
+    # source -> (next URL, hops) as fetched (a replayed record is already
+    # resolved, but its target may have started redirecting since)
+    chain = {p["loc"]: (p["redirect_to"], p.get("hops", 1))
+             for p in pages if is_redirect(p)}
+    resolved = {}
+    counts = {"resolved": 0, "loops": 0}
+    for source, (target, hops) in chain.items():
+        seen = {source}
+        while target in chain and target not in seen and hops <= max_hops:
+            seen.add(target)
+            nxt, n = chain[target]
+            target, hops = nxt, hops + n
+        if target in seen or hops > max_hops:
+            resolved[source] = None
+            counts["loops"] += 1
+            continue
+        resolved[source] = (target, hops)
+        counts["resolved"] += 1
+    return resolved, counts
+
+
+def collapse_duplicates(pages):
+    """
+    {url -> url it collapses into} for the 200 pages of a crawl that
+    should not be listed on their own:
+
+    - pages whose rel=canonical (followed through redirects) is another
+      listed page;
+    - pages with the same content hash as another page. Of each group,
+      the URL other pages name as canonical is kept, else the shortest.
+    """
+    # one pass, keeping only what is needed of each record
+    listed, finals, by_hash = {}, {}, {}
+    for p in pages:
+        if p["status"] == 200:
+            listed[p["loc"]] = p.get("canonical")
+            if p.get("hash"):
+                by_hash.setdefault(p["hash"], []).append(p["loc"])
+        elif is_redirect(p) and not p.get("redirect_loop"):
+            finals[p["loc"]] = p["redirect_to"]
+
+    into = {}
+    for url, canonical in listed.items():
+        canonical = finals.get(canonical, canonical)
+        if not canonical or canonical == url or canonical not in listed:
+            continue
+        # only trust a canonical that names itself (or nothing) in turn
+        if listed[canonical] in (None, canonical):
+            into[url] = canonical
+
+    named = set(into.values())
+    for urls in by_hash.values():
+        urls = [u for u in urls if u not in into]
+        if len(urls) < 2:
+            continue
+        keep = min(urls, key=lambda u: (u not in named, len(u), u))
+        for url in urls:
+            if url != keep:
+                into[url] = keep
+
+    # a canonical target may itself have been collapsed by hash
+    for url, target in into.items():
+        into[url] = into.get(target, target)
+    return into
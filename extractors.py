@@ -0,0 +1,119 @@
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+
+class LinkExtractor:
+    """
+    Pulls crawlable references out of an HTML body.
+
+    extract(html) returns three lists of raw URLs: followable <a href>
+    targets, <img src> and <video>/<source> src, then the page's
+    <link rel="canonical"> href (or None). Values are resolved
+    against the document's <base href> when it has one; anything else
+    (making them absolute, filtering external hosts) is up to the crawler.
+    Anchors with rel="nofollow" are left out.
+    """
+    name = None
+
+    def extract(self, html):
+        raise NotImplementedError
+
+
+def is_nofollow(rel):
+    return rel is not None and "nofollow" in rel.lower().split()
+
+
+def resolve(base_href, values):
+    if not base_href:
+        return values
+    return [urljoin(base_href, v) for v in values]
+
+
+class SoupExtractor(LinkExtractor):
+    """Builds a full BeautifulSoup tree with html.parser and queries it."""
+    name = "soup"
+
+    def extract(self, html):
+        soup = BeautifulSoup(html, "html.parser")
+        base = soup.find("base", href=True)
+        base_href = base["href"] if base else None
+
+        links = []
+        for a in soup.find_all("a", href=True):
+            rel = a.get("rel")
+            # bs4 splits rel into a list of tokens
+            if is_nofollow(" ".join(rel) if isinstance(rel, list) else rel):
+                continue
+            links.append(a["href"])
+        images = [img["src"] for img in soup.find_all("img", src=True)]
+        videos = [v["src"] for v in soup.find_all(["video", "source"], src=True)]
+        canonical = None
+        for link in soup.find_all("link", href=True):
+            if "canonical" in " ".join(link.get("rel") or []).lower().split():
+                canonical = resolve(base_href, [link["href"]])[0]
+                break
+        return (resolve(base_href, links), resolve(base_href, images),
+                resolve(base_href, videos), canonical)
+
+
+class _RefCollector(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.base_href = None
+        self.canonical = None
+        self.links, self.images, self.videos = [], [], []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            attrs = dict(attrs)
+            if "href" in attrs and not is_nofollow(attrs.get("rel")):
+                self.links.append(attrs["href"] or "")
+        elif tag == "img":
+            src = dict(attrs).get("src", False)
+            if src is not False:
+                self.images.append(src or "")
+        elif tag in ("video", "source"):
+            src = dict(attrs).get("src", False)
+            if src is not False:
+                self.videos.append(src or "")
+        elif tag == "link" and self.canonical is None:
+            attrs = dict(attrs)
+            if "canonical" in (attrs.get("rel") or "").lower().split():
+                self.canonical = attrs.get("href") or None
+        elif tag == "base" and self.base_href is None:
+            # the first <base href> applies to the whole document
+            self.base_href = dict(attrs).get("href")
+
+    handle_startendtag = handle_starttag
+
+
+class StreamingExtractor(LinkExtractor):
+    """
+    Event-based extraction on top of html.parser: only the start tags we
+    care about are looked at and no tree is ever built.
+    """
+    name = "stream"
+
+    def extract(self, html):
+        collector = _RefCollector()
+        collector.feed(html)
+        collector.close()
+        base_href = collector.base_href
+        canonical = collector.canonical
+        return (resolve(base_href, collector.links),
+                resolve(base_href, collector.images),
+                resolve(base_href, collector.videos),
+                resolve(base_href, [canonical])[0] if canonical else None)
+
+
+EXTRACTORS = {cls.name: cls for cls in (SoupExtractor, StreamingExtractor)}
+
+
+def get_extractor(name):
+    try:
+        return EXTRACTORS[name]()
+    except KeyError:
+        raise ValueError(f"unknown link extractor {name!r}, "
+                         f"expected one of {sorted(EXTRACTORS)}")
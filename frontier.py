@@ -0,0 +1,113 @@
+import math
+import heapq
+import hashlib
+from collections import deque
+
+
+class BloomFilter:
+    """
+    Fixed-size probabilistic set. Membership tests can return false
+    positives (at roughly `error_rate`) but never false negatives, so a
+    crawler using it may skip a few unseen URLs but never fetches one twice.
+    """
+    def __init__(self, capacity, error_rate=0.001):
+        capacity     = max(1, int(capacity))
+        self.size    = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes  = max(1, round(self.size / capacity * math.log(2)))
+        self.bits    = bytearray((self.size + 7) // 8)
+        self.count   = 0
+
+    def _positions(self, item):
+        # double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        """Set the bits for `item`. Returns True if it was not present yet."""
+        bits, new = self.bits, False
+        for pos in self._positions(item):
+            mask = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask:
+                bits[pos >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+    def __len__(self):
+        return self.count
+
+
+class Frontier:
+    """
+    FIFO crawl frontier with enqueue-time dedup: a URL is queued at most
+    once per crawl, so the queue never holds duplicates and push/pop are
+    O(1). Pass `bloom_capacity` to track seen URLs in a BloomFilter instead
+    of an exact set when memory must stay bounded on very large sites.
+
+    With `prioritized`, the queue is a heap instead: shallower URLs come
+    out first and, at the same depth, `urgent` ones (e.g. pages known to
+    have changed) before the rest; push/pop become O(log n).
+    """
+    def __init__(self, bloom_capacity=None, error_rate=0.001, prioritized=False):
+        self.prioritized = prioritized
+        self.queue = [] if prioritized else deque()
+        self._seq  = 0     # heap tie-breaker: FIFO within a priority
+        self.bloom = bool(bloom_capacity)
+        if self.bloom:
+            self.seen = BloomFilter(bloom_capacity, error_rate)
+        else:
+            self.seen = set()
+
+    def push(self, url, depth=0, urgent=False):
+        """Queue `url` unless it was already seen. Returns True if queued."""
+        if self.bloom:
+            # test-and-set in a single pass over the hash positions
+            if not self.seen.add(url):
+                return False
+        elif url in self.seen:
+            return False
+        else:
+            self.seen.add(url)
+        self._enqueue(url, depth, 0 if urgent else 1)
+        return True
+
+    def _enqueue(self, url, depth, rank):
+        if self.prioritized:
+            self._seq += 1
+            heapq.heappush(self.queue, (depth, rank, self._seq, url))
+        else:
+            self.queue.append((url, depth))
+
+    def pop_entry(self):
+        """Next (url, depth) to crawl."""
+        if self.prioritized:
+            depth, _, _, url = heapq.heappop(self.queue)
+            return url, depth
+        return self.queue.popleft()
+
+    def pop(self):
+        return self.pop_entry()[0]
+
+    def requeue(self, entries):
+        """Put already-seen (url, depth) entries back in front of their peers."""
+        if self.prioritized:
+            for url, depth in entries:
+                self._enqueue(url, depth, -1)
+        else:
+            self.queue.extendleft(reversed(list(entries)))
+
+    def __contains__(self, url):
+        return url in self.seen
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __bool__(self):
+        return bool(self.queue)
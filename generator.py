@@ -1,33 +1,263 @@
 import os
-from datetime import datetime
+import re
+import gzip
+import json
+import hashlib
+from contextlib import nullcontext
+from datetime import datetime, timezone
 from jinja2 import Environment, FileSystemLoader
 
 TEMPLATES_PATH = os.path.join(os.path.dirname(__file__), "templates")
 env = Environment(loader=FileSystemLoader(TEMPLATES_PATH), autoescape=True)
 
-def split_urls(urls):
-    # Google allows max 50k URLs per sitemap
-    chunk_size = 50000
-    for i in range(0, len(urls), chunk_size):
-        yield urls[i:i+chunk_size]
+# Google allows max 50k URLs and 50 MB (uncompressed) per sitemap
+MAX_URLS  = 50000
+MAX_BYTES = 50 * 1024 * 1024
 
-def write_sitemaps(site_id, site_name, base_output, urls, tpl_name, prefix):
+
+class SitemapWriter:
+    """
+    Writes sitemap entries one at a time, rolling over to a new numbered
+    file whenever the next entry would break the URL-count or byte limit.
+    Only the entry being rendered is held in memory.
+
+    Each file is written under a temporary name and renamed into place
+    once complete. With `compress`, a gzipped twin (`.xml.gz`) is written
+    in the same pass.
+
+    Every file gets a sha256 digest of its content (`digests`). Files
+    whose digest matches the one in `previous` are left untouched, mtime
+    included, and their temporary copy is dropped.
+
+    With `key` (item -> URL), files are cut at content-defined points:
+    after at least half of `max_urls` entries, at the first entry whose
+    key hashes to a boundary. Feed entries in a stable order (e.g. by
+    URL) and adding or removing a URL then only changes the file it
+    falls in, instead of shifting every file after it.
+
+    The template must define header(), entry(item) and footer() macros.
+    """
+    def __init__(self, base_output, tpl_name, filename_fmt,
+                 max_urls=MAX_URLS, max_bytes=MAX_BYTES, compress=False,
+                 previous=None, key=None):
+        tpl = env.get_template(tpl_name).module
+        self.entry       = tpl.entry
+        self.header      = str(tpl.header()).encode("utf-8")
+        self.footer      = str(tpl.footer()).encode("utf-8")
+        self.base_output = base_output
+        self.filename_fmt = filename_fmt    # e.g. "pages_site1_{}.xml"
+        self.max_urls    = max_urls
+        self.max_bytes   = max_bytes
+        self.compress    = compress
+        self.files       = []
+        self.count       = 0                # entries written overall
+        self.previous    = previous or {}   # filename -> digest, last run
+        self.digests     = {}               # filename -> digest, this run
+        self.rewritten   = []               # files whose content changed
+        self.key         = key
+        self.min_urls    = max_urls // 2
+        # one entry in `boundary` ends a file once past min_urls
+        self.boundary    = max(1, max_urls // 8)
+        self._f          = None
+        self._gz         = None
+        self._cut        = False
+
+    def _targets(self):
+        path = os.path.join(self.base_output, self.files[-1])
+        return [path, path + ".gz"] if self.compress else [path]
+
+    def _open(self):
+        self.files.append(self.filename_fmt.format(len(self.files) + 1))
+        path = os.path.join(self.base_output, self.files[-1])
+        self._f = open(path + ".tmp", "wb")
+        if self.compress:
+            # mtime=0 keeps the output byte-identical for identical input
+            self._gz_raw = open(path + ".gz.tmp", "wb")
+            self._gz = gzip.GzipFile(filename="", mode="wb", compresslevel=6,
+                                     fileobj=self._gz_raw, mtime=0)
+        self._urls, self._bytes = 0, len(self.header) + len(self.footer)
+        self._sha = hashlib.sha256()
+        self._emit(self.header)
+
+    def _emit(self, data):
+        self._f.write(data)
+        self._sha.update(data)
+        if self._gz:
+            self._gz.write(data)
+
+    def _close(self, discard=False):
+        if not self._f:
+            return
+        if not discard:
+            self._emit(self.footer)
+        self._f.close()
+        if self._gz:
+            self._gz.close()
+            self._gz_raw.close()
+        filename = self.files[-1]
+        targets  = self._targets()
+        if not discard:
+            digest = self._sha.hexdigest()
+            self.digests[filename] = digest
+            unchanged = (self.previous.get(filename) == digest
+                         and all(os.path.exists(p) for p in targets))
+            if not unchanged:
+                self.rewritten.append(filename)
+        for path in targets:
+            if discard or unchanged:
+                os.remove(path + ".tmp")
+            else:
+                os.replace(path + ".tmp", path)
+        self._f = self._gz = None
+
+    def write(self, item):
+        data = str(self.entry(item)).encode("utf-8")
+        if (self._f is None or self._cut or self._urls >= self.max_urls
+                or self._bytes + len(data) > self.max_bytes):
+            self._close()
+            self._open()
+        self._emit(data)
+        self._urls  += 1
+        self._bytes += len(data)
+        self.count  += 1
+        self._cut = (self.key is not None and self._urls >= self.min_urls
+                     and self._is_boundary(self.key(item)))
+
+    def _is_boundary(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") % self.boundary == 0
+
+    def close(self):
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # never rename a half-written file into place
+        self._close(discard=exc_type is not None)
+
+
+def remove_stale(base_output, filename_fmt, keep, compress=False):
+    """
+    Delete numbered files of a previous run beyond the ones just written,
+    and gzipped twins when compression is off.
+    """
+    pattern = re.compile(
+        re.escape(filename_fmt).replace(r"\{\}", r"(\d+)") + r"(\.gz)?$"
+    )
+    for fn in os.listdir(base_output):
+        m = pattern.match(fn)
+        if m and (int(m.group(1)) > keep or (m.group(2) and not compress)):
+            os.remove(os.path.join(base_output, fn))
+
+
+def write_atomic(path, data):
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def write_if_changed(path, data):
+    """write_atomic, skipped when the file already holds `data`. Returns True if written."""
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    write_atomic(path, data)
+    return True
+
+
+def digests_filename(filename_fmt):
+    # "pages_site1_{}.xml" -> "pages_site1.digests.json"
+    return filename_fmt.replace("_{}.xml", ".digests.json")
+
+
+def load_digests(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def index_filename(site_id, prefix):
+    return f"{prefix}_index_site{site_id}.xml"
+
+
+def write_index(site_id, output_dir, prefix, files, loc_base):
+    """
+    Persist the <sitemapindex> for one sitemap type. Each entry's lastmod
+    is the modification time of the file it points to, so the index only
+    changes (and is only rewritten) when one of its files did.
+    """
+    sitemaps = []
+    for fn in files:
+        mtime = os.path.getmtime(os.path.join(output_dir, fn))
+        sitemaps.append({
+            "loc": f"{loc_base}/{fn}",
+            "lastmod": datetime.fromtimestamp(mtime, timezone.utc)
+        })
+    xml = env.get_template("sitemap_index.xml.j2").render(sitemaps=sitemaps)
+    filename = index_filename(site_id, prefix)
+    write_if_changed(os.path.join(output_dir, filename), xml.encode("utf-8"))
+    return filename
+
+
+def write_sitemaps(site_id, site_name, base_output, urls, tpl_name, prefix,
+                   compress=False, key=None, stats=None):
+    """
+    Generates one or more sitemap files for any iterable of URLs, which
+    is consumed lazily. Files whose content is the same as last time are
+    not rewritten; their digests are kept next to them.
     """
-    Generates one or more sitemap files for a given list of URLs.
+    filename_fmt = f"{prefix}_site{site_id}_{{}}.xml"
+    digests_path = os.path.join(base_output, digests_filename(filename_fmt))
+    with SitemapWriter(base_output, tpl_name, filename_fmt,
+                       compress=compress, previous=load_digests(digests_path),
+                       key=key) as writer:
+        for url in urls:
+            writer.write(url)
+    remove_stale(base_output, filename_fmt, len(writer.files), compress)
+    write_if_changed(digests_path,
+                     json.dumps(writer.digests, sort_keys=True).encode("utf-8"))
+    if stats is not None:
+        stats.inc("sitemap_files", "rewritten", len(writer.rewritten))
+        stats.inc("sitemap_files", "unchanged",
+                  len(writer.files) - len(writer.rewritten))
+    return writer.files
+
+def generate_all(site_id, site_name, output_dir, pages, images, videos,
+                 compress=False, index_base=None, stats=None):
     """
-    tpl = env.get_template(tpl_name)
-    files = []
-    for idx, chunk in enumerate(split_urls(urls), start=1):       
-        filename = f"{prefix}_site{site_id}_{idx}.xml"
-        path = os.path.join(base_output, filename)
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(tpl.render(urls=chunk, now=datetime.utcnow()))
-        files.append(filename)
-    return files
+    Write the pages/images/videos sitemaps of a site. With `index_base`
+    (the public URL the files are reachable under), a sitemap index is
+    also persisted for every type split over several files. With `stats`
+    (a metrics.ScanStats), the time spent on each type is recorded as a
+    render_<type> phase.
 
-def generate_all(site_id, site_name, output_dir, pages, images, videos):
+    `pages` yields rows with a .url and .lastmod; `images` and `videos`
+    yield media.MediaGroup (page URL, media URLs), one <url> each.
+
+    Pass every iterable sorted by (page) URL: files are then cut at
+    stable points and only those whose entries changed get rewritten.
+    """
     os.makedirs(output_dir, exist_ok=True)
-    pages_files = write_sitemaps(site_id, site_name, output_dir, pages, "pages_sitemap.xml.j2", "pages")
-    image_files = write_sitemaps(site_id, site_name, output_dir, images, "images_sitemap.xml.j2", "images")
-    video_files = write_sitemaps(site_id, site_name, output_dir, videos, "videos_sitemap.xml.j2", "videos")
+    phase = stats.phase if stats is not None else (lambda name: nullcontext())
+    with phase("render_pages"):
+        pages_files = write_sitemaps(site_id, site_name, output_dir, pages, "pages_sitemap.xml.j2", "pages", compress,
+                                     key=lambda page: page.url, stats=stats)
+    with phase("render_images"):
+        image_files = write_sitemaps(site_id, site_name, output_dir, images, "images_sitemap.xml.j2", "images", compress,
+                                     key=lambda group: group.loc, stats=stats)
+    with phase("render_videos"):
+        video_files = write_sitemaps(site_id, site_name, output_dir, videos, "videos_sitemap.xml.j2", "videos", compress,
+                                     key=lambda group: group.loc, stats=stats)
+    if index_base:
+        for prefix, files in (("pages", pages_files), ("images", image_files),
+                              ("videos", video_files)):
+            if len(files) > 1:
+                write_index(site_id, output_dir, prefix, files, index_base)
     return pages_files, image_files, video_files
@@ -0,0 +1,293 @@
+import os
+import time
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import select, func
+
+from models import db_session, Website, Scan, ScanJob
+from retention import DB_MAINTENANCE_CRON, maintain_db
+from workers import worker_name, is_dead
+
+# parallel scans (each one a whole-site crawl) per process
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", 2))
+# cap on running scans across every process sharing the database (0 = off)
+SCAN_MAX_RUNNING = int(os.getenv("SCAN_MAX_RUNNING", 0))
+# random delay (seconds) added to cron fire times, so sites sharing a
+# schedule (e.g. all "daily" ones at midnight) don't all start at once
+SCAN_JITTER = int(os.getenv("SCAN_JITTER", 60))
+# a running job whose process hasn't checked in for that long (seconds)
+# is queued again; running jobs check in four times as often
+SCAN_JOB_TIMEOUT = int(os.getenv("SCAN_JOB_TIMEOUT", 300))
+
+ACTIVE = ("queued", "running")
+
+
+class ScanQueue:
+    """
+    Persisted scan queue drained by a pool of worker threads.
+
+    Jobs live in the scan_jobs table, so queued work survives a restart.
+    A running job carries the process running it (worker_name()) and a
+    heartbeat; it is queued again once that process is gone (same host)
+    or silent for SCAN_JOB_TIMEOUT, never while another process sharing
+    the table is still on it. At most one job per website is queued or
+    running at a time. Every worker uses its own thread-local session.
+    """
+    def __init__(self, run, workers=SCAN_WORKERS, max_running=SCAN_MAX_RUNNING,
+                 poll_interval=5.0):
+        self.run           = run          # run(website_id) -> scan id
+        self.workers       = max(1, int(workers))
+        self.max_running   = max_running
+        self.poll_interval = poll_interval
+        self.on_done       = []           # callbacks(website_id, job_id)
+        self._wake         = threading.Condition()
+        self._claim_lock   = threading.Lock()
+        self._threads      = []
+        self._stopping     = False
+        self.worker        = worker_name()
+        self._running      = set()        # ids of the jobs this process runs
+
+    # ─── producer side ──────────────────────────────────────────────
+    def enqueue(self, website_id):
+        """
+        Queue a scan for a website. Returns (job, created): when a scan of
+        that site is already queued or running, that job is returned and
+        nothing new is queued.
+        """
+        session = db_session()
+        try:
+            with self._claim_lock:
+                job = (
+                    session.query(ScanJob)
+                           .filter(ScanJob.website_id == website_id,
+                                   ScanJob.status.in_(ACTIVE))
+                           .order_by(ScanJob.id)
+                           .first()
+                )
+                if job:
+                    return job, False
+                job = ScanJob(website_id=website_id, status="queued")
+                session.add(job)
+                session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        with self._wake:
+            self._wake.notify()
+        return job, True
+
+    def enqueue_scheduled(self, website_id):
+        """Cron entry point: enqueue, then release the scheduler thread's session."""
+        try:
+            self.enqueue(website_id)
+        finally:
+            db_session.remove()
+
+    def get(self, job_id):
+        return db_session().get(ScanJob, job_id)
+
+    # ─── consumer side ──────────────────────────────────────────────
+    def start(self):
+        # jobs interrupted by a restart go back to the queue
+        try:
+            self.requeue_lost()
+        finally:
+            db_session.remove()
+
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"scan-worker-{i}",
+                                 daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._heartbeat, name="scan-heartbeat", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def stop(self):
+        self._stopping = True
+        with self._wake:
+            self._wake.notify_all()
+
+    def requeue_lost(self):
+        """
+        Queue again the running jobs whose process is gone: a process of
+        this host that no longer exists, or any that hasn't checked in
+        for SCAN_JOB_TIMEOUT. Returns how many.
+        """
+        session = db_session()
+        silent = datetime.utcnow() - timedelta(seconds=SCAN_JOB_TIMEOUT)
+        running = (
+            session.query(ScanJob.id, ScanJob.worker, ScanJob.heartbeat, ScanJob.started)
+                   .filter(ScanJob.status == "running")
+                   .all()
+        )
+        lost = []
+        for job in running:
+            seen = job.heartbeat or job.started
+            if is_dead(job.worker) or seen is None or seen < silent:
+                lost.append(job.id)
+        if lost:
+            (session.query(ScanJob)
+                    .filter(ScanJob.id.in_(lost), ScanJob.status == "running")
+                    .update({"status": "queued", "started": None, "worker": None,
+                             "heartbeat": None}, synchronize_session=False))
+        session.commit()
+        return len(lost)
+
+    def _heartbeat(self):
+        """Check in for this process' running jobs, and requeue lost ones."""
+        while not self._stopping:
+            time.sleep(SCAN_JOB_TIMEOUT / 4)
+            session = db_session()
+            try:
+                running = list(self._running)
+                if running:
+                    (session.query(ScanJob)
+                            .filter(ScanJob.id.in_(running),
+                                    ScanJob.worker == self.worker)
+                            .update({"heartbeat": datetime.utcnow()},
+                                    synchronize_session=False))
+                    session.commit()
+                if self.requeue_lost():
+                    with self._wake:
+                        self._wake.notify_all()
+            except Exception:
+                session.rollback()
+                traceback.print_exc()
+            finally:
+                db_session.remove()
+
+    def _claim(self):
+        """
+        Mark the oldest queued job as running and return (job id, website
+        id). The claim is one conditional UPDATE, which also holds the
+        SCAN_MAX_RUNNING check, so other processes draining the same
+        table can neither take the same job nor push past the limit.
+        """
+        session = db_session()
+        with self._claim_lock:
+            while True:
+                job = (
+                    session.query(ScanJob.id, ScanJob.website_id)
+                           .filter(ScanJob.status == "queued")
+                           .order_by(ScanJob.created, ScanJob.id)
+                           .first()
+                )
+                if not job:
+                    return None
+                conditions = [ScanJob.id == job.id, ScanJob.status == "queued"]
+                if self.max_running:
+                    conditions.append(running_count() < self.max_running)
+                claimed = (
+                    session.query(ScanJob)
+                           .filter(*conditions)
+                           .update({"status": "running",
+                                    "started": datetime.utcnow(),
+                                    "worker": self.worker,
+                                    "heartbeat": datetime.utcnow()},
+                                   synchronize_session=False)
+                )
+                session.commit()
+                if claimed:
+                    self._running.add(job.id)
+                    return job.id, job.website_id
+                if self.max_running and session.get(ScanJob, job.id).status == "queued":
+                    # still there: the limit is reached
+                    return None
+
+    def _worker(self):
+        while not self._stopping:
+            try:
+                claimed = self._claim()
+            except Exception:
+                traceback.print_exc()
+                claimed = None
+            finally:
+                db_session.remove()
+
+            if not claimed:
+                with self._wake:
+                    self._wake.wait(self.poll_interval)
+                continue
+
+            job_id, website_id = claimed
+            self._execute(job_id, website_id)
+
+    def _execute(self, job_id, website_id):
+        status, scan_id, error = "done", None, None
+        try:
+            scan_id = self.run(website_id)
+        except Exception as e:
+            traceback.print_exc()
+            status, error = "error", str(e)
+        finally:
+            self._running.discard(job_id)
+            db_session.remove()
+
+        session = db_session()
+        try:
+            scan = session.get(Scan, scan_id) if scan_id else None
+            if scan is not None and scan.errors:
+                # run_scan records crawl failures as an error scan
+                status, error = "error", scan.errors
+            job = session.get(ScanJob, job_id)
+            job.status   = status
+            job.scan_id  = scan_id
+            job.error    = error
+            job.finished = datetime.utcnow()
+            session.commit()
+        finally:
+            db_session.remove()
+
+        for callback in self.on_done:
+            try:
+                callback(website_id, job_id)
+            except Exception:
+                traceback.print_exc()
+
+
+def running_count():
+    """
+    Scalar subquery counting running jobs, usable in an UPDATE of
+    scan_jobs itself (MySQL needs it wrapped in a derived table).
+    """
+    running = (
+        select(func.count().label("n"))
+        .where(ScanJob.status == "running")
+        .subquery()
+    )
+    return select(running.c.n).scalar_subquery()
+
+
+def schedule_all(sched, queue):
+    """
+    (Re)register one cron job per website that enqueues its scan, plus
+    the database maintenance job.
+    """
+    sched.remove_all_jobs()
+    session = db_session()
+    for ws in session.query(Website.id, Website.cron_schedule):
+        schedule_site(sched, queue, ws.id, ws.cron_schedule)
+    db_session.remove()
+    if DB_MAINTENANCE_CRON:
+        sched.add_job(maintain_db, cron_trigger(DB_MAINTENANCE_CRON, jitter=0),
+                      id="db_maintenance", replace_existing=True)
+
+
+def cron_trigger(cron_schedule, jitter=SCAN_JITTER):
+    """CronTrigger.from_crontab, plus a fire-time jitter."""
+    values = cron_schedule.split()
+    if len(values) != 5:
+        raise ValueError(f"Wrong number of fields; got {len(values)}, expected 5")
+    minute, hour, day, month, day_of_week = values
+    return CronTrigger(minute=minute, hour=hour, day=day, month=month,
+                       day_of_week=day_of_week, jitter=jitter or None)
+
+
+def schedule_site(sched, queue, website_id, cron_schedule):
+    trig = cron_trigger(cron_schedule)
+    sched.add_job(queue.enqueue_scheduled, trig, args=[website_id],
+                  id=f"site_{website_id}", replace_existing=True)
@@ -0,0 +1,70 @@
+from array import array
+from collections import namedtuple
+
+# Google: at most 1,000 <image:image> per <url>; applied to videos too
+MAX_MEDIA_PER_PAGE = 1000
+
+# one <url> of an image/video sitemap: the page and the media found on it
+MediaGroup = namedtuple("MediaGroup", "loc urls")
+
+
+class MediaIndex:
+    """
+    Images and videos found during a crawl, by the page they appear on.
+    Each media URL is stored once and pages refer to it by integer id
+    (an array of ids per page), so a logo used on every page costs one
+    string plus four bytes a page.
+    """
+    def __init__(self):
+        self.urls   = []    # id -> media URL
+        self.ids    = {}    # media URL -> id
+        self.images = {}    # page URL -> array of ids
+        self.videos = {}
+
+    def _intern(self, url):
+        i = self.ids.get(url)
+        if i is None:
+            i = self.ids[url] = len(self.urls)
+            self.urls.append(url)
+        return i
+
+    def _ids(self, urls):
+        return array("I", dict.fromkeys(self._intern(u) for u in urls))
+
+    def add(self, page, images, videos):
+        """Record the media of `page`; a page seen again replaces its entry."""
+        if images:
+            self.images[page] = self._ids(images)
+        if videos:
+            self.videos[page] = self._ids(videos)
+
+    def collapse(self, into):
+        """Move the media of pages to the page they collapse into ({url -> url})."""
+        for by_page in (self.images, self.videos):
+            for page, target in into.items():
+                ids = by_page.pop(page, None)
+                if ids is not None:
+                    by_page[target] = array("I", dict.fromkeys(
+                        list(by_page.get(target, ())) + list(ids)))
+
+    def distinct(self, kind):
+        """Every media URL of `kind` ("images" or "videos"), once."""
+        seen = set()
+        for ids in getattr(self, kind).values():
+            seen.update(ids)
+        return [self.urls[i] for i in sorted(seen)]
+
+    def grouped(self, kind, limit=MAX_MEDIA_PER_PAGE):
+        """
+        Yield a MediaGroup per page, in URL order, for the media of
+        `kind`. Each media URL is listed once, on the first page that
+        has it, so shared assets (logos, sprites) don't repeat; at most
+        `limit` per page, the rest are left to later pages that have them.
+        """
+        by_page = getattr(self, kind)
+        listed = set()
+        for page in sorted(by_page):
+            ids = [i for i in by_page[page] if i not in listed][:limit]
+            if ids:
+                listed.update(ids)
+                yield MediaGroup(page, [self.urls[i] for i in ids])
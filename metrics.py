@@ -0,0 +1,157 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# upper bounds per histogram; anything above the last one lands in +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PARSE_BUCKETS   = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+BYTES_BUCKETS   = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HISTOGRAMS = {
+    "fetch_seconds":    LATENCY_BUCKETS,   # request start to body read
+    "response_seconds": LATENCY_BUCKETS,   # request start to headers parsed
+    "response_bytes":   BYTES_BUCKETS,     # decoded body size
+    "parse_seconds":    PARSE_BUCKETS,     # link extraction
+    "db_batch_seconds": PARSE_BUCKETS,     # one executemany() of page rows
+}
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+    def __init__(self, buckets, counts=None, total=0.0, count=0):
+        self.buckets = tuple(buckets)
+        self.counts  = list(counts) if counts else [0] * (len(self.buckets) + 1)
+        self.sum     = total
+        self.count   = count
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum   += value
+        self.count += 1
+
+    def to_dict(self):
+        return {"buckets": list(self.buckets), "counts": self.counts,
+                "sum": self.sum, "count": self.count}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["buckets"], d["counts"], d["sum"], d["count"])
+
+
+class ScanStats:
+    """
+    Metrics of one scan: histograms, per-key counters, wall-clock phase
+    durations and plain values (gauges). Safe to update from the crawler's worker threads.
+    to_dict() is plain JSON, which is what ends up in Scan.extra_info.
+    """
+    def __init__(self):
+        self.histograms = {name: Histogram(b) for name, b in HISTOGRAMS.items()}
+        self.counters   = {}    # name -> {key -> count}
+        self.phases     = {}    # name -> seconds
+        self.gauges     = {}    # name -> value
+        self._lock      = threading.Lock()
+
+    def observe(self, name, value):
+        with self._lock:
+            self.histograms[name].observe(value)
+
+    def inc(self, name, key, n=1):
+        key = str(key)
+        with self._lock:
+            counter = self.counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + n
+
+    def set(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    @contextmanager
+    def timer(self, name):
+        """Observe the duration of the block into histogram `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    @contextmanager
+    def phase(self, name):
+        """Add the duration of the block to phase `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def merge(self, d):
+        """Fold in the to_dict() of another ScanStats (e.g. from a crawl process)."""
+        with self._lock:
+            for name, h in d.get("histograms", {}).items():
+                mine = self.histograms[name]
+                mine.counts = [a + b for a, b in zip(mine.counts, h["counts"])]
+                mine.sum   += h["sum"]
+                mine.count += h["count"]
+            for name, counter in d.get("counters", {}).items():
+                mine = self.counters.setdefault(name, {})
+                for key, n in counter.items():
+                    mine[key] = mine.get(key, 0) + n
+            for name, seconds in d.get("phases", {}).items():
+                self.phases[name] = self.phases.get(name, 0.0) + seconds
+            self.gauges.update(d.get("gauges", {}))
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "histograms": {n: h.to_dict() for n, h in self.histograms.items()},
+                "counters":   {n: dict(c) for n, c in self.counters.items()},
+                "phases":     {n: round(s, 6) for n, s in self.phases.items()},
+                "gauges":     dict(self.gauges),
+            }
+
+
+# ─── Prometheus text exposition ──────────────────────────────────
+def _labels(labels):
+    if not labels:
+        return ""
+    inner = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                     for k, v in labels.items())
+    return "{" + inner + "}"
+
+
+def _num(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Exposition:
+    """Collects samples and renders them in the Prometheus text format."""
+    def __init__(self):
+        self._families = {}    # name -> (type, help, [lines])
+
+    def _family(self, name, kind, help_text):
+        return self._families.setdefault(name, (kind, help_text, []))[2]
+
+    def gauge(self, name, value, help_text="", **labels):
+        self._family(name, "gauge", help_text).append(
+            f"{name}{_labels(labels)} {_num(value)}")
+
+    def histogram(self, name, hist, help_text="", **labels):
+        lines, cumulative = self._family(name, "histogram", help_text), 0
+        for bound, n in zip(hist.buckets + (float("inf"),), hist.counts):
+            cumulative += n
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': _num(bound)})} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {_num(float(hist.sum))}")
+        lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+
+    def render(self):
+        out = []
+        for name, (kind, help_text, lines) in self._families.items():
+            if help_text:
+                out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
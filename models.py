@@ -1,16 +1,47 @@
 import os
 from datetime import datetime
 from sqlalchemy import (
-    create_engine, Column, Integer, String, DateTime, Text, JSON,
-    ForeignKey, Index
+    create_engine, Column, Integer, Float, String, DateTime, Text, JSON,
+    ForeignKey, Index, PickleType, inspect, text, event
 )
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, scoped_session
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///data/scans.db")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# SQLite tuning, applied to every new connection
+SQLITE_CACHE_MB     = int(os.getenv("SQLITE_CACHE_MB", 64))
+SQLITE_MMAP_MB      = int(os.getenv("SQLITE_MMAP_MB", 256))
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 30000))   # ms
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False} if IS_SQLITE else {}
+)
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_conn, conn_record):
+        """
+        WAL lets readers (Flask views) run while a scan writes, and only
+        fsyncs at checkpoints with synchronous=NORMAL. Writers that find
+        the database locked wait up to busy_timeout instead of failing.
+        """
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}")     # KiB
+        cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.close()
+
 SessionLocal = sessionmaker(bind=engine)
+# one session per thread (Flask requests, scheduler and scan workers);
+# call db_session.remove() when a thread's unit of work is done
+db_session = scoped_session(SessionLocal)
 Base = declarative_base()
 
 class Website(Base):
@@ -40,6 +71,11 @@ class Scan(Base):
     errors          = Column(Text)
     extra_info      = Column(JSON)
 
+    __table_args__ = (
+        # "last scan of a website" lookups
+        Index("ix_scans_website_id_timestamp", "website_id", "timestamp"),
+    )
+
     website = relationship("Website", back_populates="scans")
     pages   = relationship(
         "PageScan", back_populates="scan", cascade="all, delete-orphan"
@@ -54,8 +90,222 @@ class PageScan(Base):
     lastmod     = Column(DateTime, nullable=True)    # parsed Last-Modified
     redirect_to = Column(String, nullable=True)      # final target if redirect
     content_hash  = Column(String, nullable=True)   # <— new
+    etag          = Column(String, nullable=True)   # validators for conditional re-crawl
+    last_modified = Column(String, nullable=True)   # raw Last-Modified header
+    # page left out of the sitemap as a duplicate of this URL (same body
+    # or rel=canonical)
+    duplicate_of  = Column(String, nullable=True)
     scan = relationship("Scan", back_populates="pages")
 
+    __table_args__ = (
+        # per-scan lookups by status (/broken, sitemap rows)
+        Index("ix_page_scans_scan_id_status", "scan_id", "status"),
+    )
+
+class PageLinks(Base):
+    """
+    Links and media extracted from a page body, keyed by website and
+    content hash, so unchanged pages are replayed instead of parsed
+    again. Per website: the same body on two sites (staging and
+    production, mirrors) links to different absolute URLs.
+    """
+    __tablename__ = "page_links"
+    website_id   = Column(Integer, ForeignKey("websites.id", ondelete="CASCADE"), primary_key=True)
+    content_hash = Column(String, primary_key=True)
+    links        = Column(JSON, nullable=False)   # internal <a href> targets
+    images       = Column(JSON, nullable=False)
+    videos       = Column(JSON, nullable=False)
+    canonical    = Column(String)                 # <link rel="canonical">, if any
+    created      = Column(DateTime, default=datetime.utcnow)
+
+
+class PageState(Base):
+    """
+    Current state of every URL of a website, as of its latest successful
+    scan. Updated in place from the diff of each scan, so the previous
+    state never has to be read back from page_scans snapshots.
+    """
+    __tablename__ = "page_states"
+    website_id    = Column(Integer, ForeignKey("websites.id", ondelete="CASCADE"), primary_key=True)
+    url           = Column(String, primary_key=True)
+    status        = Column(Integer, nullable=False)
+    lastmod       = Column(DateTime)
+    redirect_to   = Column(String)
+    content_hash  = Column(String)
+    etag          = Column(String)
+    last_modified = Column(String)
+
+
+class Redirect(Base):
+    """
+    Permanent redirects of a website resolved to the end of their chain,
+    replayed by the crawler instead of fetched while still fresh.
+    """
+    __tablename__ = "redirects"
+    website_id = Column(Integer, ForeignKey("websites.id", ondelete="CASCADE"), primary_key=True)
+    source     = Column(String, primary_key=True)
+    target     = Column(String, nullable=False)   # final URL of the chain
+    hops       = Column(Integer, nullable=False)
+    status     = Column(Integer, nullable=False)  # status of the first hop
+    checked    = Column(DateTime, nullable=False) # when last actually fetched
+
+
+class PageChange(Base):
+    """Scan history as diffs: the URLs a scan added, removed or changed."""
+    __tablename__ = "page_changes"
+    id           = Column(Integer, primary_key=True)
+    scan_id      = Column(Integer, ForeignKey("scans.id", ondelete="CASCADE"), nullable=False)
+    url          = Column(String, nullable=False)
+    change       = Column(String, nullable=False)   # added/removed/changed
+    status       = Column(Integer)                  # new values; old ones for removed
+    lastmod      = Column(DateTime)
+    content_hash = Column(String)
+
+    __table_args__ = (
+        Index("ix_page_changes_scan_id", "scan_id"),
+    )
+
+
+class SiteSummary(Base):
+    """
+    Dashboard row of a website, written by run_scan when a scan ends:
+    counts of the latest successful scan plus the outcome of the latest
+    run, so read views never aggregate page_scans.
+    """
+    __tablename__ = "site_summaries"
+    website_id     = Column(Integer, ForeignKey("websites.id", ondelete="CASCADE"), primary_key=True)
+    scan_id        = Column(Integer, ForeignKey("scans.id", ondelete="SET NULL"))  # latest ok scan
+    scan_timestamp = Column(DateTime)
+    pages_found    = Column(Integer)
+    pages_included = Column(Integer)
+    images_found   = Column(Integer)
+    videos_found   = Column(Integer)
+    broken_count   = Column(Integer)
+    not_modified   = Column(Integer)
+    duration       = Column(Float)     # seconds, whole run_scan
+    crawl_seconds  = Column(Float)
+    last_status    = Column(String)    # outcome of the latest run: ok/error
+    last_error     = Column(Text)
+    updated        = Column(DateTime, default=datetime.utcnow)
+
+
+class CrawlRun(Base):
+    """A crawl of one website split over shards (see sharding.py)."""
+    __tablename__ = "crawl_runs"
+    id          = Column(Integer, primary_key=True, index=True)
+    website_id  = Column(Integer, ForeignKey("websites.id", ondelete="CASCADE"), nullable=False)
+    base_url    = Column(String, nullable=False)
+    shards      = Column(Integer, nullable=False)
+    options     = Column(JSON, nullable=False)    # SiteCrawler settings
+    status      = Column(String, nullable=False, default="running")
+    created     = Column(DateTime, default=datetime.utcnow)
+
+
+class CrawlShard(Base):
+    """One hash partition of a CrawlRun, claimed by one worker at a time."""
+    __tablename__ = "crawl_shards"
+    run_id      = Column(Integer, ForeignKey("crawl_runs.id", ondelete="CASCADE"), primary_key=True)
+    shard       = Column(Integer, primary_key=True)
+    status      = Column(String, nullable=False, default="queued")  # queued/running/done
+    worker      = Column(String)      # host:pid holding it
+    heartbeat   = Column(DateTime)
+    stats       = Column(JSON)        # ScanStats.to_dict() of the shard
+
+
+class FrontierUrl(Base):
+    """
+    Shared frontier and seen-set of a CrawlRun: every URL queued, with
+    the page record once fetched.
+    """
+    __tablename__ = "crawl_frontier"
+    run_id      = Column(Integer, ForeignKey("crawl_runs.id", ondelete="CASCADE"), primary_key=True)
+    url         = Column(String, primary_key=True)
+    shard       = Column(Integer, nullable=False)
+    depth       = Column(Integer, nullable=False)
+    state       = Column(Integer, nullable=False, default=0)  # 0 queued, 1 claimed, 2 done
+    result      = Column(PickleType)  # {record, images, videos} or {failed}
+
+    __table_args__ = (
+        Index("ix_crawl_frontier_claim", "run_id", "shard", "state", "depth"),
+        Index("ix_crawl_frontier_state", "run_id", "state"),
+    )
+
+
+class ScanJob(Base):
+    """A queued, running or finished scan request (see jobs.ScanQueue)."""
+    __tablename__ = "scan_jobs"
+    id          = Column(Integer, primary_key=True, index=True)
+    website_id  = Column(Integer, ForeignKey("websites.id", ondelete="CASCADE"), nullable=False)
+    status      = Column(String, nullable=False, default="queued")  # queued/running/done/error
+    created     = Column(DateTime, default=datetime.utcnow)
+    started     = Column(DateTime)
+    finished    = Column(DateTime)
+    scan_id     = Column(Integer, ForeignKey("scans.id", ondelete="SET NULL"))
+    error       = Column(Text)
+    # process running it (host:pid) and when it last said so
+    worker      = Column(String)
+    heartbeat   = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_scan_jobs_status_created", "status", "created"),
+        Index("ix_scan_jobs_website_id_status", "website_id", "status"),
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "website_id": self.website_id,
+            "status": self.status,
+            "created": self.created.isoformat() if self.created else None,
+            "started": self.started.isoformat() if self.started else None,
+            "finished": self.finished.isoformat() if self.finished else None,
+            "scan_id": self.scan_id,
+            "error": self.error
+        }
+
+
+def add_missing_columns():
+    """
+    create_all() never alters existing tables: add nullable columns that
+    were introduced after the database was first created.
+    """
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                coltype = col.type.compile(dialect=engine.dialect)
+                conn.execute(text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {col.name} {coltype}"
+                ))
+
+
+def add_missing_indexes():
+    """Same as add_missing_columns, for indexes added to existing tables."""
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+
+def reset_link_cache():
+    """
+    page_links used to be keyed by content hash alone, shared by every
+    website. It is only a cache: an old table is dropped and created
+    again instead of migrated.
+    """
+    insp = inspect(engine)
+    if (insp.has_table(PageLinks.__tablename__) and "website_id" not in
+            insp.get_pk_constraint(PageLinks.__tablename__)["constrained_columns"]):
+        PageLinks.__table__.drop(bind=engine)
+
 
 def init_db():
+    reset_link_cache()
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    add_missing_indexes()
@@ -0,0 +1,267 @@
+import os
+import zlib
+import pickle
+import tempfile
+from array import array
+from datetime import datetime, timedelta, timezone
+
+# page records per chunk sealed (compressed) into a temporary file; only
+# the URL table and the chunk being filled stay in memory (0 = keep
+# every record in memory, as columns)
+SPILL_ROWS = int(os.getenv("CRAWL_SPILL_ROWS", 0))
+# where spilled chunks go (default: the system temp directory)
+SPILL_DIR  = os.getenv("CRAWL_SPILL_DIR") or None
+
+NONE_ID   = -1
+NONE_TIME = -2 ** 63
+EPOCH     = datetime(1970, 1, 1, tzinfo=timezone.utc)
+DIGEST    = 32    # bytes of a sha256 content hash
+
+# boolean record fields, stored as bits of the flags column
+FLAGS   = ("not_modified", "links_replayed", "redirect_cached", "carried_over")
+_NAIVE  = 1 << 6    # lastmod had no tzinfo (read back from the database)
+_HASHED = 1 << 7    # the digest column holds the page's hash
+
+# fields with a column of their own; anything else a record carries
+# (e.g. "outlinks") is kept as is, by row
+COLUMN_FIELDS = {"loc", "status", "lastmod", "redirect_to", "hash", "etag",
+                 "last_modified", "canonical", "hops", *FLAGS}
+
+
+class UrlTable:
+    """
+    URLs interned as integer ids, each string stored once, and relative
+    to `base_url` when under it ("https://example.com/a" -> "/a").
+    """
+    def __init__(self, base_url):
+        self.base  = base_url
+        self.paths = []    # id -> URL, relative to base when under it
+        self.ids   = {}    # the same strings -> id
+
+    def _key(self, url):
+        if url.startswith(self.base):
+            rest = url[len(self.base):]
+            # absolute URLs never start with "/" or "?", so stay apart
+            if not rest or rest[0] in "/?":
+                return rest
+        return url
+
+    def intern(self, url):
+        if url is None:
+            return NONE_ID
+        key = self._key(url)
+        i = self.ids.get(key)
+        if i is None:
+            i = self.ids[key] = len(self.paths)
+            self.paths.append(key)
+        return i
+
+    def get(self, url):
+        return self.ids.get(self._key(url), NONE_ID)
+
+    def url(self, i):
+        if i == NONE_ID:
+            return None
+        path = self.paths[i]
+        return self.base + path if not path or path[0] in "/?" else path
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getstate__(self):
+        # the id map is rebuilt on load rather than pickled twice
+        return {"base": self.base, "paths": self.paths}
+
+    def __setstate__(self, state):
+        self.base  = state["base"]
+        self.paths = state["paths"]
+        self.ids   = {path: i for i, path in enumerate(self.paths)}
+
+
+def _columns():
+    return {
+        "loc":       array("i"),
+        "status":    array("H"),
+        "lastmod":   array("q"),    # microseconds since the epoch (UTC)
+        "redirect":  array("i"),
+        "canonical": array("i"),
+        "hops":      array("H"),
+        "flags":     array("B"),
+        "digests":   bytearray(),   # DIGEST bytes a record, zeros if none
+        "etags":     [],
+        "modified":  [],            # Last-Modified header as sent
+        "extra":     {}             # row of the chunk -> other fields
+    }
+
+
+def _digest(h):
+    """The 32-byte digest of a hex sha256, or None if it doesn't round-trip."""
+    if not isinstance(h, str) or len(h) != 2 * DIGEST:
+        return None
+    try:
+        digest = bytes.fromhex(h)
+    except ValueError:
+        return None
+    return digest if digest.hex() == h else None
+
+
+class PageStore:
+    """
+    Page records of a crawl, kept as columns rather than a dict per
+    page: URLs interned in a UrlTable, content hashes as binary digests,
+    lastmod as an integer, status, hops and flags as small ints.
+
+    Records go in as the crawler's dicts (append) and come out as dicts
+    again, one at a time and in the order they were added, when the
+    store is iterated; nothing builds the full list. With `spill_rows`,
+    they are sealed into zlib-compressed chunks in a temporary file
+    every that many records.
+    """
+    def __init__(self, base_url, spill_rows=None, spill_dir=None):
+        self.urls       = UrlTable(base_url)
+        self.spill_rows = SPILL_ROWS if spill_rows is None else spill_rows
+        self.spill_dir  = spill_dir or SPILL_DIR
+        self.counts     = dict.fromkeys(FLAGS, 0)
+        # source id -> (final id, hops), or None for a loop (see resolve)
+        self.resolved   = {}
+        self._live      = _columns()
+        self._sealed    = []      # chunk blobs, or (offset, size) in _file
+        self._file      = None
+        self._len       = 0
+
+    def __len__(self):
+        return self._len
+
+    def count(self, flag):
+        """Number of records with `flag` (one of FLAGS) set."""
+        return self.counts[flag]
+
+    def append(self, p):
+        c, urls = self._live, self.urls
+        flags = 0
+        for bit, name in enumerate(FLAGS):
+            if p.get(name):
+                flags |= 1 << bit
+                self.counts[name] += 1
+        lm = p.get("lastmod")
+        if lm is None:
+            us = NONE_TIME
+        else:
+            if lm.tzinfo is None:
+                flags |= _NAIVE
+                lm = lm.replace(tzinfo=timezone.utc)
+            us = (lm - EPOCH) // timedelta(microseconds=1)
+        extra = {k: v for k, v in p.items() if k not in COLUMN_FIELDS}
+        digest = _digest(p.get("hash"))
+        if digest is not None:
+            flags |= _HASHED
+        else:
+            digest = bytes(DIGEST)
+            if p.get("hash") is not None:
+                extra["hash"] = p["hash"]
+
+        c["loc"].append(urls.intern(p["loc"]))
+        c["status"].append(p["status"])
+        c["lastmod"].append(us)
+        c["redirect"].append(urls.intern(p.get("redirect_to")))
+        c["canonical"].append(urls.intern(p.get("canonical")))
+        c["hops"].append(p.get("hops") or 0)
+        c["flags"].append(flags)
+        c["digests"] += digest
+        c["etags"].append(p.get("etag"))
+        c["modified"].append(p.get("last_modified"))
+        if extra:
+            c["extra"][len(c["loc"]) - 1] = extra
+        self._len += 1
+        if self.spill_rows and len(c["loc"]) >= self.spill_rows:
+            self._spill(zlib.compress(pickle.dumps(c, pickle.HIGHEST_PROTOCOL), 1))
+            self._live = _columns()
+
+    def extend(self, records):
+        for p in records:
+            self.append(p)
+
+    def resolve(self, chains):
+        """
+        Apply resolved redirect chains ({source -> (final URL, hops)},
+        None for loops; see dedupe.resolve_redirects): from then on the
+        source's record has the final redirect_to and its hops, or
+        "redirect_loop".
+        """
+        for url, chain in chains.items():
+            i = self.urls.get(url)
+            if i == NONE_ID:
+                continue
+            self.resolved[i] = (None if chain is None
+                                else (self.urls.intern(chain[0]), chain[1]))
+
+    def __iter__(self):
+        for entry in self._sealed:
+            yield from self._records(pickle.loads(zlib.decompress(self._blob(entry))))
+        yield from self._records(self._live)
+
+    def _records(self, c):
+        url, resolved = self.urls.url, self.resolved
+        digests, extra = c["digests"], c["extra"]
+        for j, loc in enumerate(c["loc"]):
+            flags = c["flags"][j]
+            lastmod = c["lastmod"][j]
+            if lastmod == NONE_TIME:
+                lastmod = None
+            else:
+                lastmod = EPOCH + timedelta(microseconds=lastmod)
+                if flags & _NAIVE:
+                    lastmod = lastmod.replace(tzinfo=None)
+            p = {"loc": url(loc), "status": c["status"][j], "lastmod": lastmod,
+                 "redirect_to": url(c["redirect"][j])}
+            if flags & _HASHED:
+                p["hash"] = digests[j * DIGEST:(j + 1) * DIGEST].hex()
+            if c["etags"][j] is not None:
+                p["etag"] = c["etags"][j]
+            if c["modified"][j] is not None:
+                p["last_modified"] = c["modified"][j]
+            if c["canonical"][j] != NONE_ID:
+                p["canonical"] = url(c["canonical"][j])
+            if c["hops"][j]:
+                p["hops"] = c["hops"][j]
+            for bit, name in enumerate(FLAGS):
+                if flags & (1 << bit):
+                    p[name] = True
+            if j in extra:
+                p.update(extra[j])
+            if loc in resolved:
+                chain = resolved[loc]
+                if chain is None:
+                    p["redirect_loop"] = True
+                else:
+                    p["redirect_to"], p["hops"] = url(chain[0]), chain[1]
+            yield p
+
+    # ─── spilled chunks ─────────────────────────────────────────────
+    def _spill(self, blob):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix="pages-", dir=self.spill_dir)
+        self._file.seek(0, os.SEEK_END)
+        self._sealed.append((self._file.tell(), len(blob)))
+        self._file.write(blob)
+
+    def _blob(self, entry):
+        if isinstance(entry, bytes):
+            return entry
+        offset, size = entry
+        self._file.seek(offset)
+        return self._file.read(size)
+
+    def __getstate__(self):
+        # checkpoints carry the spilled chunks along, still compressed
+        state = self.__dict__.copy()
+        state["_sealed"] = [self._blob(e) for e in self._sealed]
+        state["_file"]   = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.spill_rows:
+            sealed, self._sealed = self._sealed, []
+            for blob in sealed:
+                self._spill(blob)
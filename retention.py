@@ -0,0 +1,204 @@
+import os
+import traceback
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert, update, delete, func, tuple_, text
+
+from models import (
+    engine, db_session as session, Website, Scan, PageScan, PageLinks,
+    PageState, PageChange
+)
+
+# full page_scans snapshots kept per website (latest successful scans,
+# 0 = all); older scans keep their Scan row and their page_changes diff
+RETAIN_SNAPSHOTS    = int(os.getenv("RETAIN_SNAPSHOTS", 3))
+# days of page_changes history kept (0 = forever)
+RETAIN_HISTORY_DAYS = int(os.getenv("RETAIN_HISTORY_DAYS", 180))
+# cron expression of the prune + VACUUM/ANALYZE run ("" = never)
+DB_MAINTENANCE_CRON = os.getenv("DB_MAINTENANCE_CRON", "30 4 * * *")
+
+STATE_FIELDS = ("status", "lastmod", "redirect_to", "content_hash", "etag",
+                "last_modified")
+# fields whose change is recorded in page_changes (validators are not)
+CHANGE_FIELDS = ("status", "redirect_to", "content_hash")
+
+BATCH = 1000
+
+
+def state_row(row):
+    state = {f: row.get(f) for f in STATE_FIELDS}
+    lm = state["lastmod"]
+    if lm is not None and lm.tzinfo:
+        # stored naive (UTC); compare the way it will read back
+        state["lastmod"] = lm.astimezone(timezone.utc).replace(tzinfo=None)
+    return state
+
+
+def is_change(old, new):
+    if any(getattr(old, f) != new[f] for f in CHANGE_FIELDS):
+        return True
+    # broken pages get the crawl time as lastmod on every scan
+    return new["status"] in (200, 301) and old.lastmod != new["lastmod"]
+
+
+def merge_state(state, row):
+    """
+    Add a page_scans row to a {url -> state} map. A URL can be recorded
+    twice (as a page and as the target of a redirect); the 200 wins.
+    """
+    old = state.get(row["url"])
+    if old is None or (old["status"] != 200 and row["status"] == 200):
+        state[row["url"]] = state_row(row)
+
+
+def _batches(items, size=BATCH):
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+
+def seed_state(website_id, scan_id):
+    """Build page_states from a page_scans snapshot (databases from before page_states)."""
+    state = {}
+    rows = (
+        session.query(PageScan.url, *[getattr(PageScan, f) for f in STATE_FIELDS])
+               .filter(PageScan.scan_id == scan_id)
+               .yield_per(5000)
+    )
+    for r in rows:
+        merge_state(state, r._asdict())
+    for chunk in _batches(list(state.items())):
+        session.execute(insert(PageState),
+                        [dict(website_id=website_id, url=u, **s) for u, s in chunk])
+    return len(state)
+
+
+def apply_scan_diff(website_id, scan_id, prev_map, new_state):
+    """
+    Bring page_states of a website from `prev_map` (rows as loaded by
+    scanner.load_previous_state) to `new_state` ({url -> state}), and
+    record what changed in page_changes. Returns the change counts.
+    """
+    added, updated, changes = [], [], []
+    for url, new in new_state.items():
+        old = prev_map.get(url)
+        if old is None:
+            added.append(dict(website_id=website_id, url=url, **new))
+            changes.append(dict(scan_id=scan_id, url=url, change="added",
+                                status=new["status"], lastmod=new["lastmod"],
+                                content_hash=new["content_hash"]))
+            continue
+        if any(getattr(old, f) != new[f] for f in STATE_FIELDS):
+            updated.append(dict(website_id=website_id, url=url, **new))
+            if is_change(old, new):
+                changes.append(dict(scan_id=scan_id, url=url, change="changed",
+                                    status=new["status"], lastmod=new["lastmod"],
+                                    content_hash=new["content_hash"]))
+    removed = [url for url in prev_map if url not in new_state]
+    for url in removed:
+        old = prev_map[url]
+        changes.append(dict(scan_id=scan_id, url=url, change="removed",
+                            status=old.status, lastmod=old.lastmod,
+                            content_hash=old.content_hash))
+
+    # ORM bulk UPDATE by primary key (website_id, url)
+    for chunk in _batches(updated):
+        session.execute(update(PageState), chunk)
+    for chunk in _batches(removed):
+        session.execute(delete(PageState)
+                        .where(PageState.website_id == website_id,
+                               PageState.url.in_(chunk)))
+    for chunk in _batches(added):
+        session.execute(insert(PageState), chunk)
+    for chunk in _batches(changes):
+        session.execute(insert(PageChange), chunk)
+    changed = len(changes) - len(added) - len(removed)
+    return {"added": len(added), "removed": len(removed), "changed": changed}
+
+
+def prune_site(website_id):
+    """
+    Drop the page_scans snapshots of all but the RETAIN_SNAPSHOTS latest
+    successful scans of a website (failed scans whose rows were saved
+    included), and page_changes older than RETAIN_HISTORY_DAYS. Returns
+    the number of rows deleted.
+
+    Scans newer than the latest successful one are left alone: one may
+    still be streaming its rows into the sitemaps (SCAN_INCOMPLETE), as
+    this runs from the scheduler while scans are going on.
+    """
+    keep = RETAIN_SNAPSHOTS
+    newest_ok = (
+        session.query(func.max(Scan.timestamp))
+               .filter_by(website_id=website_id, errors=None)
+               .scalar()
+    )
+    if keep > 0 and newest_ok is not None:
+        latest = (
+            session.query(Scan.id)
+                   .filter_by(website_id=website_id, errors=None)
+                   .order_by(Scan.timestamp.desc())
+                   .limit(keep)
+        )
+        old_scans = [
+            sid for (sid,) in session.query(Scan.id)
+                                     .filter(Scan.website_id == website_id,
+                                             Scan.timestamp <= newest_ok,
+                                             Scan.id.notin_(latest))
+        ]
+    else:
+        old_scans = []
+    deleted = 0
+    for chunk in _batches(old_scans, 100):
+        deleted += session.execute(
+            delete(PageScan).where(PageScan.scan_id.in_(chunk))
+        ).rowcount
+    if RETAIN_HISTORY_DAYS > 0:
+        cutoff = datetime.utcnow() - timedelta(days=RETAIN_HISTORY_DAYS)
+        expired = (
+            session.query(Scan.id)
+                   .filter(Scan.website_id == website_id, Scan.timestamp < cutoff)
+        )
+        deleted += session.execute(
+            delete(PageChange).where(PageChange.scan_id.in_(expired))
+        ).rowcount
+    return deleted
+
+
+def prune_link_cache():
+    """Forget parsed links of bodies no current page of their website has anymore."""
+    current = (
+        session.query(PageState.website_id, PageState.content_hash)
+               .filter(PageState.content_hash.isnot(None))
+    )
+    return session.execute(
+        delete(PageLinks).where(
+            tuple_(PageLinks.website_id, PageLinks.content_hash).notin_(current))
+    ).rowcount
+
+
+def maintain_db():
+    """
+    Periodic job: prune every website, then ANALYZE and (on SQLite)
+    VACUUM, so the file actually shrinks. Runs on its own connection in
+    autocommit mode, as VACUUM cannot run inside a transaction.
+    """
+    try:
+        for (website_id,) in session.query(Website.id).all():
+            prune_site(website_id)
+            session.commit()
+        prune_link_cache()
+        session.commit()
+    except Exception:
+        session.rollback()
+        traceback.print_exc()
+    finally:
+        session.remove()
+
+    try:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("ANALYZE"))
+            if engine.dialect.name == "sqlite":
+                conn.execute(text("VACUUM"))
+    except Exception:
+        # e.g. "database is locked" while a scan is writing; next run will do
+        traceback.print_exc()
@@ -0,0 +1,599 @@
+import os
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+from sqlalchemy import insert, delete
+
+from models import (
+    db_session as session, Website, Scan, PageScan, PageLinks, PageState,
+    Redirect, SiteSummary
+)
+from crawler import SiteCrawler
+from workers import crawl_in_process
+from generator import generate_all
+from metrics import ScanStats
+from dbwriter import writer
+from sharding import crawl_sharded
+from dedupe import resolve_redirects, collapse_duplicates, PERMANENT_REDIRECTS
+from retention import seed_state, merge_state, apply_scan_diff, prune_site
+from emailer import send_report
+
+# ─── Crawl settings ───────────────────────────────────────────────
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", 4))
+CRAWL_DELAY       = float(os.getenv("CRAWL_DELAY", 0.5))
+# page records (incl. redirects and 404s) per scan
+CRAWL_MAX_PAGES   = int(os.getenv("CRAWL_MAX_PAGES", 10000))
+# > 0 switches the frontier's seen-set to a Bloom filter of that capacity
+CRAWL_BLOOM_CAPACITY = int(os.getenv("CRAWL_BLOOM_CAPACITY", 0))
+# revalidate pages from the previous scan with If-None-Match/If-Modified-Since
+CRAWL_INCREMENTAL = os.getenv("CRAWL_INCREMENTAL", "1") == "1"
+# link extraction backend: "stream" (event-based) or "soup" (BeautifulSoup)
+CRAWL_EXTRACTOR   = os.getenv("CRAWL_EXTRACTOR", "stream")
+# keep-alive connections per host (defaults to CRAWL_CONCURRENCY)
+CRAWL_POOL_SIZE   = int(os.getenv("CRAWL_POOL_SIZE", 0))
+
+# seconds between crawl checkpoints (0 = off); an interrupted or failed
+# scan of the same site resumes from the last one
+CRAWL_CHECKPOINT_INTERVAL = int(os.getenv("CRAWL_CHECKPOINT_INTERVAL", 60))
+# checkpoints older than this (seconds) are ignored and the crawl starts over
+CRAWL_CHECKPOINT_MAX_AGE  = int(os.getenv("CRAWL_CHECKPOINT_MAX_AGE", 24 * 3600))
+
+# seed the frontier from robots.txt / the site's existing sitemaps
+CRAWL_SEED     = os.getenv("CRAWL_SEED", "0") == "1"
+# crawl shallow pages, and pages that changed last scan, first
+CRAWL_PRIORITY = os.getenv("CRAWL_PRIORITY", "1" if CRAWL_SEED else "0") == "1"
+# honor robots.txt Disallow and Crawl-delay
+CRAWL_ROBOTS   = os.getenv("CRAWL_ROBOTS", "0") == "1"
+# adapt delay and parallel requests (up to CRAWL_CONCURRENCY) to the
+# server's response times and 429/503s; CRAWL_DELAY is the starting delay
+CRAWL_ADAPTIVE    = os.getenv("CRAWL_ADAPTIVE", "1") == "1"
+CRAWL_MIN_DELAY   = float(os.getenv("CRAWL_MIN_DELAY", 0.0))
+CRAWL_MAX_DELAY   = float(os.getenv("CRAWL_MAX_DELAY", 30.0))
+# attempts after a timeout, connection error, 429 or 5xx, the first one
+# CRAWL_RETRY_BACKOFF seconds later and doubling; at most
+# CRAWL_RETRY_QUEUE URLs wait for a retry at once
+CRAWL_MAX_RETRIES   = int(os.getenv("CRAWL_MAX_RETRIES", 3))
+CRAWL_RETRY_BACKOFF = float(os.getenv("CRAWL_RETRY_BACKOFF", 1.0))
+CRAWL_RETRY_QUEUE   = int(os.getenv("CRAWL_RETRY_QUEUE", 1000))
+# hours a permanent redirect is replayed from the cache before it is
+# fetched again (0 = always fetch)
+CRAWL_REDIRECT_CACHE_HOURS = int(os.getenv("CRAWL_REDIRECT_CACHE_HOURS", 168))
+
+# "thread": crawl inside the scan worker thread; "process": crawl in a
+# child process so parsing and hashing are not bound by this process' GIL
+SCAN_EXECUTOR     = os.getenv("SCAN_EXECUTOR", "thread")
+# > 1 splits each crawl over that many hash partitions of the URL space,
+# crawled by worker processes through a frontier in the database (see
+# sharding.py); CRAWL_SHARD_PROCESSES of them run locally (default: one
+# per shard, 0 = only workers started on other nodes)
+CRAWL_SHARDS          = int(os.getenv("CRAWL_SHARDS", 0))
+CRAWL_SHARD_PROCESSES = int(os.getenv("CRAWL_SHARD_PROCESSES", CRAWL_SHARDS))
+
+# ─── Sitemap output ───────────────────────────────────────────────
+# also write .xml.gz twins, served to clients that accept gzip
+SITEMAP_GZIP = os.getenv("SITEMAP_GZIP", "1") == "1"
+
+def sitemap_loc_base(site_id):
+    """Public URL prefix the sitemap files of a site are served under."""
+    return f"{os.getenv('BASE_URL')}/reports/site_{site_id}"
+
+
+def checkpoint_path(site_id):
+    return os.path.join("data", f"site_{site_id}", "crawl.checkpoint")
+
+
+def crawl_site(url, previous, link_cache, checkpoint=None, changed=None,
+               stats=None, redirects=None, website_id=None):
+    """Crawl a site with the configured settings and executor."""
+    if CRAWL_SHARDS > 1 and website_id is not None:
+        # shard workers load previous state and caches themselves; the
+        # database run replaces the checkpoint
+        return crawl_sharded(website_id, url, sharded_options(), CRAWL_SHARDS,
+                             CRAWL_SHARD_PROCESSES, seed=CRAWL_SEED,
+                             max_age=CRAWL_CHECKPOINT_MAX_AGE, stats=stats)
+    if checkpoint:
+        os.makedirs(os.path.dirname(checkpoint), exist_ok=True)
+    options = dict(
+        max_pages=CRAWL_MAX_PAGES, delay=CRAWL_DELAY, concurrency=CRAWL_CONCURRENCY,
+        bloom_capacity=CRAWL_BLOOM_CAPACITY or None,
+        previous=previous, link_cache=link_cache,
+        extractor=CRAWL_EXTRACTOR, pool_size=CRAWL_POOL_SIZE or None,
+        checkpoint_path=checkpoint if CRAWL_CHECKPOINT_INTERVAL else None,
+        checkpoint_interval=CRAWL_CHECKPOINT_INTERVAL,
+        checkpoint_max_age=CRAWL_CHECKPOINT_MAX_AGE,
+        seed=CRAWL_SEED, prioritize=CRAWL_PRIORITY, robots=CRAWL_ROBOTS,
+        changed=changed, redirects=redirects,
+        adaptive=CRAWL_ADAPTIVE, min_delay=CRAWL_MIN_DELAY, max_delay=CRAWL_MAX_DELAY,
+        max_retries=CRAWL_MAX_RETRIES, retry_backoff=CRAWL_RETRY_BACKOFF,
+        max_retry_queue=CRAWL_RETRY_QUEUE
+    )
+    if SCAN_EXECUTOR == "process":
+        # stats can't be shared with the child; merge what it sends back
+        data = crawl_in_process(url, **options)
+        if stats is not None:
+            stats.merge(data["stats"])
+        return data
+    return SiteCrawler(url, stats=stats, **options).crawl()
+
+
+def sharded_options():
+    """SiteCrawler settings of a shard worker (stored as JSON with the run)."""
+    return dict(
+        max_pages=CRAWL_MAX_PAGES, delay=CRAWL_DELAY, concurrency=CRAWL_CONCURRENCY,
+        extractor=CRAWL_EXTRACTOR, pool_size=CRAWL_POOL_SIZE or None,
+        robots=CRAWL_ROBOTS, incremental=CRAWL_INCREMENTAL,
+        adaptive=CRAWL_ADAPTIVE, min_delay=CRAWL_MIN_DELAY, max_delay=CRAWL_MAX_DELAY,
+        max_retries=CRAWL_MAX_RETRIES, retry_backoff=CRAWL_RETRY_BACKOFF,
+        max_retry_queue=CRAWL_RETRY_QUEUE
+    )
+
+
+def decide_lastmod(p, prev_map, crawl_dt):
+    """
+    p: dict from crawler with loc, status, lastmod, redirect_to, hash
+    prev_map: { url -> row } as of the previous scan (see load_previous_state)
+    crawl_dt: datetime.utcnow() of this run
+    """
+    # if the server gave us a Last-Modified header, use it
+    if p.get("lastmod"):
+        return p["lastmod"], p.get("hash")
+
+    # fallback: what we knew about this URL last time
+    prev = prev_map.get(p["loc"])
+
+    # first time ever: record this crawl date and its hash
+    if not prev:
+        return crawl_dt, p.get("hash")
+
+    # content changed?
+    if p.get("hash") and p["hash"] != prev.content_hash:
+        return crawl_dt, p["hash"]
+
+    # unchanged: keep old lastmod and old hash
+    return prev.lastmod, prev.content_hash
+
+
+# current-state columns that decide_lastmod, the incremental crawl and
+# the scan diff need; loaded as plain rows, not ORM objects
+PREVIOUS_STATE_COLUMNS = (
+    PageState.url, PageState.status, PageState.lastmod, PageState.redirect_to,
+    PageState.content_hash, PageState.etag, PageState.last_modified
+)
+
+def load_previous_state(website_id, last_scan_id=None):
+    """
+    { url -> row } of a website as of its latest successful scan, read
+    from page_states. Sites scanned before page_states existed get it
+    built from the page_scans snapshot of `last_scan_id` first.
+    """
+    query = (
+        session.query(*PREVIOUS_STATE_COLUMNS)
+               .filter(PageState.website_id == website_id)
+    )
+    if last_scan_id is not None and query.first() is None:
+        writer.run(seed_state, website_id, last_scan_id)
+        session.rollback()    # end the read snapshot taken before the seed
+    return { r.url: r for r in query.yield_per(5000) }
+
+# rows per executemany() batch when persisting page results
+INSERT_BATCH = 1000
+
+def insert_page_rows(rows, stats=None):
+    if rows:
+        if stats is None:
+            session.execute(insert(PageScan), rows)
+            return
+        with stats.timer("db_batch_seconds"), stats.phase("db"):
+            session.execute(insert(PageScan), rows)
+
+
+def conditional_state(prev_map):
+    """
+    Per-URL validators the crawler needs to revalidate pages of the
+    previous scan, plus what to reuse when the server answers 304.
+    """
+    state = {}
+    for url, p in prev_map.items():
+        if p.status != 200 or not (p.etag or p.last_modified):
+            continue
+        state[url] = {
+            "etag": p.etag,
+            "last_modified": p.last_modified,
+            "lastmod": p.lastmod,
+            "hash": p.content_hash
+        }
+    return state
+
+
+def recently_changed(prev_map, since):
+    """URLs whose lastmod is at or after `since`, i.e. that changed since that scan."""
+    changed = set()
+    for url, p in prev_map.items():
+        lm = p.lastmod
+        if lm is None:
+            continue
+        if lm.tzinfo:
+            lm = lm.astimezone(timezone.utc).replace(tzinfo=None)
+        if lm >= since:
+            changed.add(url)
+    return changed
+
+
+def load_link_cache(website_id):
+    """{content_hash -> {links, images, videos, canonical}} for the current pages of a site."""
+    hashes = (
+        session.query(PageState.content_hash)
+               .filter(PageState.website_id == website_id,
+                       PageState.content_hash.isnot(None))
+    )
+    rows = session.query(PageLinks).filter(PageLinks.website_id == website_id,
+                                           PageLinks.content_hash.in_(hashes))
+    return {
+        r.content_hash: {"links": r.links, "images": r.images, "videos": r.videos,
+                         "canonical": r.canonical}
+        for r in rows
+    }
+
+
+def save_link_cache(website_id, pages):
+    """Persist the links of page bodies parsed for the first time."""
+    new = {p["hash"]: p["outlinks"] for p in pages if p.get("outlinks")}
+    hashes = list(new)
+    for i in range(0, len(hashes), 500):
+        chunk = hashes[i:i+500]
+        known = {
+            h for (h,) in session.query(PageLinks.content_hash)
+                                 .filter(PageLinks.website_id == website_id,
+                                         PageLinks.content_hash.in_(chunk))
+        }
+        for h in chunk:
+            if h not in known:
+                session.add(PageLinks(website_id=website_id, content_hash=h, **new[h]))
+
+
+def carry_over_failed(data, prev_map, link_cache):
+    """
+    Page records for the URLs this crawl failed to fetch that were fine
+    in the previous scan, so a struggling server doesn't make them drop
+    out of the sitemap. Returns how many were carried over.
+    """
+    carried = 0
+    for f in data.get("failed", ()):
+        prev = prev_map.get(f["loc"])
+        if prev is None or prev.status != 200:
+            continue
+        known = link_cache.get(prev.content_hash) or {}
+        data["pages"].append({
+            "loc": f["loc"],
+            "status": 200,
+            "lastmod": prev.lastmod,
+            "redirect_to": None,
+            "hash": prev.content_hash,
+            "etag": prev.etag,
+            "last_modified": prev.last_modified,
+            "canonical": known.get("canonical"),
+            "carried_over": True
+        })
+        data["media"].add(f["loc"], known.get("images"), known.get("videos"))
+        carried += 1
+    return carried
+
+
+def load_redirects(website_id):
+    """{source -> {target, hops, status}}: redirects fetched within CRAWL_REDIRECT_CACHE_HOURS."""
+    if CRAWL_REDIRECT_CACHE_HOURS <= 0:
+        return {}
+    fresh = datetime.utcnow() - timedelta(hours=CRAWL_REDIRECT_CACHE_HOURS)
+    rows = (
+        session.query(Redirect.source, Redirect.target, Redirect.hops, Redirect.status)
+               .filter(Redirect.website_id == website_id, Redirect.checked >= fresh)
+    )
+    return {r.source: {"target": r.target, "hops": r.hops, "status": r.status}
+            for r in rows}
+
+
+def save_redirects(website_id, pages):
+    """
+    Cache the permanent redirects fetched by this crawl (resolved to the
+    end of their chain) and forget the ones too old to be replayed.
+    """
+    now = datetime.utcnow()
+    rows = [
+        dict(website_id=website_id, source=p["loc"], target=p["redirect_to"],
+             hops=p["hops"], status=p["status"], checked=now)
+        for p in pages
+        if p["status"] in PERMANENT_REDIRECTS and p.get("redirect_to")
+        and not p.get("redirect_loop") and not p.get("redirect_cached")
+    ]
+    for i in range(0, len(rows), 500):
+        chunk = rows[i:i+500]
+        session.execute(delete(Redirect).where(
+            Redirect.website_id == website_id,
+            Redirect.source.in_([r["source"] for r in chunk])))
+        session.execute(insert(Redirect), chunk)
+    expired = now - timedelta(hours=max(CRAWL_REDIRECT_CACHE_HOURS, 0))
+    session.execute(delete(Redirect).where(Redirect.website_id == website_id,
+                                           Redirect.checked < expired))
+
+
+# Scan.errors while its rows are saved but its sitemaps not yet written;
+# keeps it out of "latest successful scan" lookups until finish_scan
+SCAN_INCOMPLETE = "incomplete"
+
+def update_summary(website_id, **values):
+    """Upsert the SiteSummary row of a website (committed by the caller)."""
+    summary = session.get(SiteSummary, website_id)
+    if summary is None:
+        summary = SiteSummary(website_id=website_id)
+        session.add(summary)
+    for name, value in values.items():
+        setattr(summary, name, value)
+    summary.updated = datetime.utcnow()
+    return summary
+
+
+def persist_scan(website_id, data, prev_map, crawl_dt, stats, duplicates):
+    """
+    Writer job: record the Scan, its page rows, new link cache and
+    redirect cache entries and the page_states diff, in one transaction.
+    The scan stays marked SCAN_INCOMPLETE until finish_scan.
+
+    Pages in `duplicates` ({url -> url}) are recorded with duplicate_of
+    and left out of the sitemap.
+    """
+    pages = data["pages"]    # PageStore: dicts with loc/status/lastmod/redirect_to
+    scan = Scan(
+        website_id     = website_id,
+        timestamp      = datetime.utcnow(),
+        pages_found    = len(pages),
+        images_found   = len(data["images"]),
+        videos_found   = len(data["videos"]),
+        pages_included = 0,
+        images_included= 0,
+        videos_included= 0,
+        errors         = SCAN_INCOMPLETE,
+        extra_info     = {}
+    )
+    session.add(scan)
+    with stats.phase("db"):
+        session.flush()
+
+    # detailed per-page rows, inserted in executemany() batches
+    included_count = 0
+    broken_count   = 0
+    new_state = {}
+    batch = []
+    for p in pages:
+        if p["status"] == 404:
+            broken_count += 1
+        lm, ch = decide_lastmod(p, prev_map, crawl_dt)
+        # redirects are recorded under their source, pointing at the end
+        # of the chain; the target is listed through its own 200 record
+        duplicate_of = duplicates.get(p["loc"])
+        batch.append(dict(
+            scan_id     = scan.id,
+            url         = p["loc"],
+            status      = p["status"],
+            lastmod     = lm,
+            redirect_to = p.get("redirect_to"),
+            content_hash= ch,
+            etag        = p.get("etag") if p["status"] == 200 else None,
+            last_modified = p.get("last_modified") if p["status"] == 200 else None,
+            duplicate_of = duplicate_of
+        ))
+        # this URL goes into sitemap
+        if p["status"] == 200 and duplicate_of is None:
+            included_count += 1
+        merge_state(new_state, batch[-1])
+        if len(batch) >= INSERT_BATCH:
+            insert_page_rows(batch, stats)
+            batch = []
+    insert_page_rows(batch, stats)
+
+    with stats.phase("db"):
+        # move the current state forward and keep the diff as history
+        diff = apply_scan_diff(website_id, scan.id, prev_map, new_state)
+        save_link_cache(website_id, pages)
+        save_redirects(website_id, pages)
+        session.flush()
+
+    return {
+        "scan_id": scan.id, "timestamp": scan.timestamp,
+        "included": included_count, "broken": broken_count, "diff": diff
+    }
+
+
+def finish_scan(website_id, scan_id, included, image_files, video_files,
+                extra_info, summary):
+    """Writer job: mark a persisted scan successful once its sitemaps are written."""
+    scan = session.get(Scan, scan_id)
+    scan.errors          = None
+    scan.pages_included  = included
+    scan.images_included = len(image_files)
+    scan.videos_included = len(video_files)
+    scan.extra_info      = extra_info
+    ws = session.get(Website, website_id)
+    ws.last_scan   = datetime.utcnow()
+    ws.last_status = "ok"
+    update_summary(website_id, scan_id=scan_id, scan_timestamp=scan.timestamp,
+                   pages_found=scan.pages_found, pages_included=included,
+                   images_found=scan.images_found, videos_found=scan.videos_found,
+                   last_status="ok", last_error=None, **summary)
+
+
+def record_failure(website_id, scan_id, error, extra_info, duration):
+    """
+    Writer job: flag the scan as failed (recording an error scan when it
+    never got persisted). Returns its id.
+    """
+    ws = session.get(Website, website_id)
+    ws.last_scan   = datetime.utcnow()
+    ws.last_status = "error"
+
+    scan = session.get(Scan, scan_id) if scan_id else None
+    if scan is None:
+        scan = Scan(
+            website_id     = website_id,
+            pages_found    = 0,
+            images_found   = 0,
+            videos_found   = 0,
+            pages_included = 0,
+            images_included= 0,
+            videos_included= 0,
+            extra_info     = {}
+        )
+        session.add(scan)
+    scan.errors     = error
+    scan.extra_info = {**(scan.extra_info or {}), **extra_info}
+    # keep the counts of the last good scan, record the failure
+    update_summary(website_id, duration=duration, last_status="error",
+                   last_error=error)
+    session.flush()
+    return scan.id
+
+
+def run_scan(website_id):
+    """
+    Crawl a website, persist the scan and regenerate its sitemaps.
+    Returns the id of the recorded Scan (an error scan on failure).
+
+    This thread only reads; every write goes through the shared
+    dbwriter, in short transactions (the scan's rows, then its final
+    status), so no transaction is held during the crawl or rendering.
+
+    The crawl is checkpointed under the site's data directory; the file
+    is only removed once the scan is committed, so the next run after a
+    failure or restart picks up where this one stopped.
+    """
+    ws = session.get(Website, website_id)
+    url = ws.url
+    checkpoint = checkpoint_path(website_id)
+    stats = ScanStats()
+    started = time.perf_counter()
+    scan_id = None
+    try:
+        # previous successful scan: lastmod/hash history and 304 validators
+        recent = (
+            session.query(Scan.id, Scan.timestamp)
+                   .filter_by(website_id=website_id, errors=None)
+                   .order_by(Scan.timestamp.desc())
+                   .limit(2)
+                   .all()
+        )
+        last = recent[0] if recent else None
+        prev_map = load_previous_state(website_id, last.id if last else None)
+        # pages that changed between the two previous scans go first
+        changed = None
+        if CRAWL_PRIORITY and len(recent) == 2:
+            changed = recently_changed(prev_map, recent[1].timestamp)
+        link_cache = load_link_cache(website_id)
+        redirects  = load_redirects(website_id)
+        # don't keep a read snapshot open for the whole crawl
+        session.rollback()
+
+        with stats.phase("crawl"):
+            data   = crawl_site(
+                url,
+                previous=conditional_state(prev_map) if CRAWL_INCREMENTAL else None,
+                link_cache=link_cache,
+                checkpoint=checkpoint,
+                changed=changed,
+                stats=stats,
+                redirects=redirects,
+                website_id=website_id
+            )
+        redirects = None
+        carried = carry_over_failed(data, prev_map, link_cache)
+        link_cache = None
+        crawl_dt = datetime.utcnow()
+        pages  = data["pages"]
+        images = data["images"]
+        videos = data["videos"]
+
+        outdir = os.path.join("data", f"site_{website_id}")
+        name   = urlparse(url).netloc
+
+        # each final URL once: chains resolved, duplicates collapsed
+        chains, redirect_counts = resolve_redirects(pages)
+        pages.resolve(chains)
+        chains = None
+        duplicates = collapse_duplicates(pages)
+        data["media"].collapse(duplicates)
+
+        saved = writer.run(persist_scan, website_id, data, prev_map, crawl_dt,
+                           stats, duplicates)
+        scan_id  = saved["scan_id"]
+        prev_map = None
+
+        # stream the sitemap entries back from the DB instead of keeping
+        # every PageScan object alive for the whole scan
+        sitemap_pages = (
+            session.query(PageScan.url, PageScan.lastmod)
+                   .filter(PageScan.scan_id == scan_id,
+                           PageScan.status == 200,
+                           PageScan.duplicate_of.is_(None))
+                   .order_by(PageScan.url)
+                   .yield_per(1000)
+        )
+        # includes streaming the page rows back from the DB
+        with stats.phase("render"):
+            pf, imf, vf = generate_all(
+                website_id, name, outdir, sitemap_pages,
+                data["media"].grouped("images"), data["media"].grouped("videos"),
+                compress=SITEMAP_GZIP, index_base=sitemap_loc_base(website_id),
+                stats=stats
+            )
+        session.rollback()
+
+        not_modified = pages.count("not_modified")
+        extra_info = {
+            "pages": pf, "images": imf, "videos": vf,
+            "not_modified": not_modified,
+            "links_replayed": pages.count("links_replayed"),
+            "resumed": data.get("resumed", 0),
+            "diff": saved["diff"],
+            "failed": len(data.get("failed", ())),
+            "carried_over": carried,
+            "redirects": redirect_counts,
+            "duplicates": len(duplicates),
+            "metrics": stats.to_dict()
+        }
+        writer.run(finish_scan, website_id, scan_id, saved["included"], imf, vf,
+                   extra_info, summary=dict(
+                       broken_count   = saved["broken"],
+                       not_modified   = not_modified,
+                       duration       = round(time.perf_counter() - started, 3),
+                       crawl_seconds  = round(stats.phases.get("crawl", 0.0), 3)
+                   ))
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        # the scan is saved: a failing prune must not turn it into an error
+        try:
+            writer.run(prune_site, website_id)
+        except Exception:
+            traceback.print_exc()
+
+        body = (
+            f"Scan ok for {url}\n"
+            f"Pages found: {len(pages)}\n"
+            f"Pages indexed: {saved['included']}\n"
+            f"Images: {len(images)}\n"
+            f"Videos: {len(videos)}\n"
+            f"Failed: {len(data.get('failed', ()))} ({carried} kept from the previous scan)\n"
+            f"Sitemaps directory: {outdir}"
+        )
+        send_report(f"[SitemapGen] Success {url}", body)
+        return scan_id
+
+    except Exception as e:
+        session.rollback()
+        # whatever was measured before the failure
+        scan_id = writer.run(record_failure, website_id, scan_id, str(e),
+                             {"metrics": stats.to_dict()},
+                             round(time.perf_counter() - started, 3))
+
+        send_report(f"[SitemapGen] ERROR {url}", f"Error: {e}")
+        return scan_id
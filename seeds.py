@@ -0,0 +1,72 @@
+import io
+import gzip
+from datetime import datetime, timezone
+from urllib.robotparser import RobotFileParser
+from xml.etree.ElementTree import iterparse
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def parse_robots(text, url=""):
+    """RobotFileParser loaded from the body of a robots.txt."""
+    rp = RobotFileParser(url)
+    rp.parse(text.splitlines())
+    return rp
+
+
+def allow_all_robots():
+    """Parser that allows everything, for sites with no robots.txt."""
+    rp = RobotFileParser()
+    rp.allow_all = True
+    return rp
+
+
+def parse_w3c_datetime(value):
+    """<lastmod> value as naive UTC, or None if it can't be parsed."""
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _local(tag):
+    # "{http://www.sitemaps.org/schemas/sitemap/0.9}loc" -> "loc"
+    return tag.rsplit("}", 1)[-1]
+
+
+def iter_sitemap(data):
+    """
+    Stream the entries of a sitemap or sitemap index body (gzipped or
+    not) as (kind, loc, lastmod) tuples, kind being "url" for a page and
+    "sitemap" for a nested sitemap of an index.
+
+    Only <loc>/<lastmod> directly under <url>/<sitemap> count: image and
+    video extensions nest their own (<image:image><image:loc>).
+    """
+    if data[:2] == GZIP_MAGIC:
+        data = gzip.decompress(data)
+    loc = lastmod = None
+    path = []    # local names of the open elements
+    for event, el in iterparse(io.BytesIO(data), events=("start", "end")):
+        tag = _local(el.tag)
+        if event == "start":
+            path.append(tag)
+            continue
+        path.pop()
+        parent = path[-1] if path else None
+        if tag == "loc" and parent in ("url", "sitemap"):
+            loc = (el.text or "").strip()
+        elif tag == "lastmod" and parent in ("url", "sitemap"):
+            lastmod = parse_w3c_datetime(el.text)
+        elif tag in ("url", "sitemap"):
+            if loc:
+                yield tag, loc, lastmod
+            loc = lastmod = None
+            # entries are independent; don't keep the tree around
+            el.clear()
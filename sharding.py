@@ -0,0 +1,479 @@
+# Sharded crawl of one website: URLs are hash-partitioned over shards,
+# each fetched and parsed by its own worker, all sharing one frontier in
+# the database (crawl_frontier, which doubles as the seen-set).
+#
+# run_scan coordinates (crawl_sharded) and starts local worker processes;
+# more workers on other nodes pointing at the same DATABASE_URL join in
+# with:
+#
+#     python sharding.py
+import os
+import time
+import heapq
+import hashlib
+import traceback
+from collections import deque
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from sqlalchemy import insert, update, delete, func
+
+from models import (
+    engine, db_session as session, init_db, CrawlRun, CrawlShard, FrontierUrl
+)
+from crawler import SiteCrawler, FetchFailed
+from media import MediaIndex
+from pagestore import PageStore
+from dbwriter import writer
+from workers import spawn_ctx, worker_name
+
+# seconds between polls of an idle worker, and of the coordinator
+SHARD_POLL    = float(os.getenv("CRAWL_SHARD_POLL", 0.5))
+# a running shard whose worker hasn't checked in for that long (seconds)
+# is handed out again
+SHARD_TIMEOUT = int(os.getenv("CRAWL_SHARD_TIMEOUT", 120))
+
+# URLs claimed at once, per request the throttle allows in flight
+CLAIM_FACTOR = 4
+# fetched URLs written back per transaction (or every SHARD_POLL seconds)
+FLUSH_ROWS   = 200
+
+QUEUED, CLAIMED, DONE = 0, 1, 2
+
+
+def shard_of(url, shards):
+    digest = hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+
+def insert_ignore(table):
+    """INSERT that skips rows whose primary key is already there."""
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(table).on_conflict_do_nothing()
+    return insert(table).prefix_with("OR IGNORE" if dialect == "sqlite" else "IGNORE")
+
+
+# ─── Coordinator side (writer jobs) ───────────────────────────────
+def start_run(website_id, base_url, shards, options, seeds, max_age):
+    """
+    Writer job: create the run of a website and queue `seeds` ((url,
+    depth) pairs), or take over its unfinished run when it is younger
+    than `max_age` seconds. Returns (run id, URLs already done).
+    """
+    run = (
+        session.query(CrawlRun)
+               .filter_by(website_id=website_id, status="running")
+               .order_by(CrawlRun.id.desc())
+               .first()
+    )
+    if run is not None and (run.shards != shards or run.base_url != base_url
+                            or datetime.utcnow() - run.created > timedelta(seconds=max_age)):
+        drop_run(run.id)
+        run = None
+    if run is None:
+        run = CrawlRun(website_id=website_id, base_url=base_url, shards=shards,
+                       options=options)
+        session.add(run)
+        session.flush()
+        session.execute(insert(CrawlShard),
+                        [dict(run_id=run.id, shard=i, status="queued") for i in range(shards)])
+    else:
+        # whoever was crawling it is gone: hand everything out again
+        session.execute(update(CrawlShard).where(CrawlShard.run_id == run.id)
+                        .values(status="queued", worker=None))
+        session.execute(update(FrontierUrl)
+                        .where(FrontierUrl.run_id == run.id, FrontierUrl.state == CLAIMED)
+                        .values(state=QUEUED))
+    session.execute(insert_ignore(FrontierUrl), [
+        dict(run_id=run.id, url=url, shard=shard_of(url, shards), depth=depth, state=QUEUED)
+        for url, depth in seeds
+    ])
+    done = (
+        session.query(func.count()).select_from(FrontierUrl)
+               .filter(FrontierUrl.run_id == run.id, FrontierUrl.state == DONE)
+               .scalar()
+    )
+    return run.id, done
+
+
+def requeue_shards(run_id, shards):
+    """Writer job: give shards whose worker went silent to someone else."""
+    session.execute(update(CrawlShard)
+                    .where(CrawlShard.run_id == run_id, CrawlShard.shard.in_(shards),
+                           CrawlShard.status == "running")
+                    .values(status="queued", worker=None))
+    session.execute(update(FrontierUrl)
+                    .where(FrontierUrl.run_id == run_id, FrontierUrl.shard.in_(shards),
+                           FrontierUrl.state == CLAIMED)
+                    .values(state=QUEUED))
+
+
+def drop_run(run_id):
+    for table in (FrontierUrl, CrawlShard):
+        session.execute(delete(table).where(table.run_id == run_id))
+    session.execute(delete(CrawlRun).where(CrawlRun.id == run_id))
+
+
+def collect_run(run_id, base_url, stats=None):
+    """Read the records, media and failures of a finished run back."""
+    pages, failed, media = PageStore(base_url), [], MediaIndex()
+    rows = (
+        session.query(FrontierUrl.result)
+               .filter(FrontierUrl.run_id == run_id, FrontierUrl.state == DONE)
+               .order_by(FrontierUrl.depth, FrontierUrl.url)
+               .yield_per(1000)
+    )
+    for (result,) in rows:
+        if not result:
+            continue    # disallowed by robots.txt
+        if "failed" in result:
+            failed.append(result["failed"])
+            continue
+        record = result["record"]
+        pages.append(record)
+        media.add(record["loc"], result["images"], result["videos"])
+    if stats is not None:
+        for (shard_stats,) in session.query(CrawlShard.stats).filter_by(run_id=run_id):
+            if shard_stats:
+                stats.merge(shard_stats)
+    return pages, failed, media
+
+
+def crawl_sharded(website_id, url, options, shards, processes=None, seed=False,
+                  max_age=24 * 3600, stats=None):
+    """
+    Crawl a site over `shards` hash partitions and return the same dict
+    as SiteCrawler.crawl(). `processes` local worker processes are
+    started (default: one per shard; 0 leaves everything to remote
+    workers); shards whose worker stops checking in are handed out again.
+
+    `options` are SiteCrawler settings; previous state, link and
+    redirect caches are loaded by each worker from the database. The
+    run is kept until it completes, so a scan that dies mid-crawl picks
+    it up again next time.
+    """
+    processes = shards if processes is None else processes
+    started = time.perf_counter()
+    seeder = SiteCrawler(url, seed=seed, robots=options.get("robots", False),
+                         delay=options.get("delay", 0.5))
+    if seed:
+        seeder.load_robots()
+        seeder.seed_from_sitemaps()
+    seeds = []
+    while seeder.frontier:
+        seeds.append(seeder.frontier.pop_entry())
+    seeder.session.close()
+
+    run_id, resumed = writer.run(start_run, website_id, seeder.base_url, shards,
+                                 options, seeds, max_age)
+    procs, crashes = [], 0
+    try:
+        while True:
+            rows = session.query(CrawlShard.shard, CrawlShard.status,
+                                 CrawlShard.heartbeat).filter_by(run_id=run_id).all()
+            session.rollback()
+            if all(r.status == "done" for r in rows):
+                break
+            silent = datetime.utcnow() - timedelta(seconds=SHARD_TIMEOUT)
+            stale = [r.shard for r in rows
+                     if r.status == "running" and r.heartbeat and r.heartbeat < silent]
+            if stale:
+                writer.run(requeue_shards, run_id, stale)
+            alive = []
+            for p in procs:
+                if p.is_alive():
+                    alive.append(p)
+                elif p.exitcode:
+                    crashes += 1
+            procs = alive
+            if crashes > 2 * shards:
+                raise RuntimeError(f"shard workers of {url} keep dying")
+            queued = sum(1 for r in rows if r.status == "queued") + len(stale)
+            while len(procs) < min(processes, queued):
+                p = spawn_ctx.Process(target=_work_process, args=(run_id,),
+                                 name=f"crawl shard {url}", daemon=True)
+                p.start()
+                procs.append(p)
+            time.sleep(SHARD_POLL)
+
+        pages, failed, media = collect_run(run_id, seeder.base_url, stats)
+        session.rollback()
+        writer.run(drop_run, run_id)
+    finally:
+        for p in procs:
+            p.join(timeout=10)
+            if p.is_alive():
+                p.terminate()
+
+    elapsed = time.perf_counter() - started
+    if stats is not None:
+        stats.set("crawl_seconds", round(elapsed, 3))
+        stats.set("pages_per_sec",
+                  round((len(pages) - resumed) / elapsed, 2) if elapsed else 0.0)
+        stats.set("shards", shards)
+    return {
+        "pages": pages,
+        "images": media.distinct("images"),
+        "videos": media.distinct("videos"),
+        "media": media,
+        "failed": failed,
+        "resumed": resumed,
+        "stats": stats.to_dict() if stats is not None else {}
+    }
+
+
+# ─── Worker side ──────────────────────────────────────────────────
+def claim_shard(run_id=None, worker=None):
+    """Take a queued shard (of `run_id`, or of any running crawl). Returns (run id, shard) or None."""
+    query = (
+        session.query(CrawlShard.run_id, CrawlShard.shard)
+               .join(CrawlRun, CrawlRun.id == CrawlShard.run_id)
+               .filter(CrawlRun.status == "running", CrawlShard.status == "queued")
+    )
+    if run_id is not None:
+        query = query.filter(CrawlShard.run_id == run_id)
+    for candidate in query.order_by(CrawlShard.run_id, CrawlShard.shard).limit(10).all():
+        claimed = session.execute(
+            update(CrawlShard)
+            .where(CrawlShard.run_id == candidate.run_id,
+                   CrawlShard.shard == candidate.shard,
+                   CrawlShard.status == "queued")
+            .values(status="running", worker=worker, heartbeat=datetime.utcnow())
+        ).rowcount
+        session.commit()
+        if claimed:
+            return candidate.run_id, candidate.shard
+    return None
+
+
+def make_crawler(run):
+    """A SiteCrawler used only to fetch and parse, set up like run_scan's."""
+    # here to avoid a circular import: scanner uses crawl_sharded
+    from scanner import (
+        load_previous_state, conditional_state, load_link_cache, load_redirects
+    )
+    options = dict(run.options)
+    incremental = options.pop("incremental", True)
+    previous = load_previous_state(run.website_id)
+    crawler = SiteCrawler(
+        run.base_url,
+        previous=conditional_state(previous) if incremental else None,
+        link_cache=load_link_cache(run.website_id),
+        redirects=load_redirects(run.website_id),
+        **options
+    )
+    session.rollback()
+    if crawler.obey_robots:
+        crawler.load_robots()
+    return crawler
+
+
+class ShardCrawl:
+    """
+    Fetch the URLs of a shard until the whole run has none left. A
+    worker with nothing to do takes on any shard still queued, so fewer
+    workers than shards get through every one of them.
+    """
+    def __init__(self, run, shard, worker):
+        self.run_id    = run.id
+        self.shards    = run.shards
+        self.owned     = [shard]
+        self.worker    = worker
+        self.max_pages = run.options.get("max_pages", 10000)
+        self.crawler   = make_crawler(run)
+        self.done      = []    # (url, result) not written back yet
+        self.links     = {}    # url -> depth, not queued yet
+
+    def claim(self, n):
+        rows = (
+            session.query(FrontierUrl.url, FrontierUrl.depth)
+                   .filter(FrontierUrl.run_id == self.run_id,
+                           FrontierUrl.shard.in_(self.owned),
+                           FrontierUrl.state == QUEUED)
+                   .order_by(FrontierUrl.depth)
+                   .limit(n)
+                   .all()
+        )
+        if rows:
+            session.execute(update(FrontierUrl)
+                            .where(FrontierUrl.run_id == self.run_id,
+                                   FrontierUrl.url.in_([r.url for r in rows]))
+                            .values(state=CLAIMED))
+        session.commit()
+        return [(r.url, r.depth) for r in rows]
+
+    def flush(self):
+        """
+        Write fetched URLs back and queue the new links they lead to, in
+        one transaction, so the frontier never looks empty while
+        someone is still about to add to it. Returns False when the
+        shard was handed to another worker.
+        """
+        if self.done:
+            session.execute(update(FrontierUrl), [
+                dict(run_id=self.run_id, url=url, state=DONE, result=result)
+                for url, result in self.done
+            ])
+        if self.links:
+            room = self.max_pages - (
+                session.query(func.count()).select_from(FrontierUrl)
+                       .filter(FrontierUrl.run_id == self.run_id).scalar()
+            )
+            urls = list(self.links)
+            for i in range(0, len(urls), 500):
+                if room <= 0:
+                    break
+                chunk = urls[i:i+500]
+                known = {
+                    u for (u,) in session.query(FrontierUrl.url)
+                                         .filter(FrontierUrl.run_id == self.run_id,
+                                                 FrontierUrl.url.in_(chunk))
+                }
+                rows = [
+                    dict(run_id=self.run_id, url=u, shard=shard_of(u, self.shards),
+                         depth=self.links[u], state=QUEUED)
+                    for u in chunk if u not in known
+                ][:room]
+                if rows:
+                    session.execute(insert_ignore(FrontierUrl), rows)
+                    room -= len(rows)
+        owned = session.execute(
+            update(CrawlShard)
+            .where(CrawlShard.run_id == self.run_id, CrawlShard.shard.in_(self.owned),
+                   CrawlShard.worker == self.worker, CrawlShard.status == "running")
+            .values(heartbeat=datetime.utcnow())
+        ).rowcount
+        session.commit()
+        self.done, self.links = [], {}
+        return owned == len(self.owned)
+
+    def take_over(self):
+        """Claim another queued shard of the run; True if there was one."""
+        claimed = claim_shard(self.run_id, self.worker)
+        if claimed:
+            self.owned.append(claimed[1])
+        return bool(claimed)
+
+    def idle(self):
+        """Nothing queued or being fetched anywhere in the run."""
+        left = (
+            session.query(func.count()).select_from(FrontierUrl)
+                   .filter(FrontierUrl.run_id == self.run_id, FrontierUrl.state != DONE)
+                   .scalar()
+        )
+        session.commit()
+        return left == 0
+
+    def finish(self):
+        # the run is idle: shards nobody got to have nothing left either
+        session.execute(update(CrawlShard)
+                        .where(CrawlShard.run_id == self.run_id,
+                               CrawlShard.status == "queued")
+                        .values(status="done"))
+        session.execute(update(CrawlShard)
+                        .where(CrawlShard.run_id == self.run_id,
+                               CrawlShard.shard == self.owned[0],
+                               CrawlShard.worker == self.worker)
+                        .values(status="done", stats=self.crawler.stats.to_dict()))
+        session.execute(update(CrawlShard)
+                        .where(CrawlShard.run_id == self.run_id,
+                               CrawlShard.shard.in_(self.owned[1:]),
+                               CrawlShard.worker == self.worker)
+                        .values(status="done"))
+        session.commit()
+
+    def handle(self, url, depth, fut, retries):
+        crawler = self.crawler
+        try:
+            record, links, images, videos = fut.result()
+        except FetchFailed as e:
+            failures = len(crawler.failed)
+            crawler.retry_later(retries, url, depth, e)
+            if len(crawler.failed) > failures:
+                self.done.append((url, {"failed": crawler.failed[-1]}))
+            return
+        self.done.append((url, {"record": record, "images": images, "videos": videos}))
+        for link in links:
+            self.links.setdefault(link, depth + 1)
+
+    def crawl(self):
+        crawler  = self.crawler
+        throttle = crawler.throttle
+        queue    = deque()    # claimed (url, depth)
+        retries  = []         # as in SiteCrawler.crawl
+        last_flush = time.monotonic()
+        with ThreadPoolExecutor(max_workers=crawler.concurrency) as pool:
+            in_flight = {}
+            while True:
+                if len(queue) < throttle.limit:
+                    queue.extend(self.claim(throttle.limit * CLAIM_FACTOR))
+                while len(in_flight) < throttle.limit:
+                    if retries and retries[0][0] <= time.monotonic():
+                        _, _, url, depth = heapq.heappop(retries)
+                    elif queue:
+                        url, depth = queue.popleft()
+                    else:
+                        break
+                    if crawler.obey_robots and not crawler.allowed(url):
+                        self.done.append((url, None))
+                        continue
+                    in_flight[pool.submit(crawler.fetch, url)] = (url, depth)
+
+                if not in_flight:
+                    if not self.flush():
+                        return False
+                    last_flush = time.monotonic()
+                    if retries or queue:
+                        time.sleep(SHARD_POLL)
+                    elif self.idle():
+                        break
+                    elif not self.take_over():
+                        time.sleep(SHARD_POLL)
+                    continue
+
+                done, _ = wait(in_flight, timeout=SHARD_POLL, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    url, depth = in_flight.pop(fut)
+                    self.handle(url, depth, fut, retries)
+                if (len(self.done) >= FLUSH_ROWS
+                        or time.monotonic() - last_flush >= SHARD_POLL):
+                    if not self.flush():
+                        return False
+                    last_flush = time.monotonic()
+        crawler.session.close()
+        self.finish()
+        return True
+
+
+def work(run_id=None, forever=False):
+    """
+    Claim shards (of `run_id`, or of any crawl) and crawl them; return
+    when there is none left, or keep polling with `forever`.
+    """
+    worker = worker_name()
+    while True:
+        try:
+            claimed = claim_shard(run_id, worker)
+            if claimed:
+                run = session.get(CrawlRun, claimed[0])
+                ShardCrawl(run, claimed[1], worker).crawl()
+        except Exception:
+            traceback.print_exc()
+            claimed = None
+        finally:
+            session.remove()
+        if not claimed:
+            if not forever:
+                return
+            time.sleep(SHARD_POLL * 4)
+
+
+def _work_process(run_id):
+    work(run_id)
+
+
+if __name__ == "__main__":
+    init_db()
+    work(forever=True)
@@ -0,0 +1,88 @@
+import os
+import queue
+import socket
+import multiprocessing
+
+from crawler import SiteCrawler
+from pagestore import PageStore
+
+# page records per message sent back to the parent
+RESULT_BATCH = 500
+
+# spawn, not fork: the parent runs Flask, APScheduler and scan threads
+spawn_ctx = multiprocessing.get_context("spawn")
+
+
+def worker_name():
+    """host:pid, how a process signs the jobs and shards it claims."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def is_dead(worker):
+    """True for a worker_name() of this host whose process is gone."""
+    host, _, pid = (worker or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def _crawl_child(out, url, options):
+    """Child process entry point: crawl and stream records to `out`."""
+    batch = []
+
+    def emit(record):
+        batch.append(record)
+        if len(batch) >= RESULT_BATCH:
+            out.put(("pages", list(batch)))
+            batch.clear()
+
+    try:
+        data = SiteCrawler(url, on_result=emit, **options).crawl()
+        if batch:
+            out.put(("pages", batch))
+        out.put(("done", {"images": data["images"], "videos": data["videos"],
+                          "media": data["media"], "failed": data["failed"],
+                          "resumed": data["resumed"],
+                          "stats": data["stats"]}))
+    except BaseException as e:
+        out.put(("error", f"{type(e).__name__}: {e}"))
+
+
+def crawl_in_process(url, **options):
+    """
+    Run SiteCrawler(url, **options).crawl() in a child process and return
+    the same {"pages", "images", "videos", "media"} dict. Page records are
+    streamed back in batches while the crawl runs, into a PageStore, so the
+    parent can keep the database and sitemap work to itself.
+    """
+    out  = spawn_ctx.Queue(maxsize=64)
+    proc = spawn_ctx.Process(target=_crawl_child, args=(out, url, options),
+                        name=f"crawl {url}", daemon=True)
+    proc.start()
+    pages = PageStore(url.rstrip("/"))
+    try:
+        while True:
+            try:
+                kind, payload = out.get(timeout=5)
+            except queue.Empty:
+                if not proc.is_alive():
+                    raise RuntimeError(
+                        f"crawl process for {url} died (exit code {proc.exitcode})"
+                    )
+                continue
+            if kind == "pages":
+                pages.extend(payload)
+            elif kind == "done":
+                return {"pages": pages, **payload}
+            else:
+                raise RuntimeError(payload)
+    finally:
+        proc.join(timeout=10)
+        if proc.is_alive():
+            proc.terminate()